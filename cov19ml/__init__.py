@@ -0,0 +1,9 @@
+"""Shared data loading and cross-validation helpers for the COV19ML analysis scripts.
+
+The scripts under ExtTab3/, ExtTab4/ and ExtFig5/ run on Colab; add the
+repository root to ``sys.path`` and import from here.
+"""
+
+from .cohort import Cohort, load_cohort
+from .matrix import CohortMatrix, attach, materialize
+from .labels import LabelScheme, encode, register_scheme
@@ -0,0 +1,162 @@
+"""Quantile-binned cohort matrix shared by every fold and experiment.
+
+With ``tree_method='hist'`` xgboost sketches histogram cut points again for
+each fold's training matrix and for each 2/3/7-class or ablation variant.
+Here the cohort is binned once per data drop: per-antigen quantile cut
+points plus uint8 bin codes, stored in the memory-mapped bundle.  Training
+matrices are ``QuantileDMatrix`` objects over the codes that take a
+reference matrix as ``ref``, so xgboost reuses its cut points instead of
+sketching.  The reference holds each code 0 .. max_bin - 1 once per column:
+its cut points separate consecutive codes, so one tiny reference serves
+every matrix of the same width (column subsets included) and gives the same
+trees as a reference sketched from the cohort.
+
+Every variant of an experiment reuses the same bins: `CVEngine` takes a
+row mask (e.g. without the critically ill), a column subset (e.g. without
+the truncated antigens) and the optional sex / age covariates, which are
+binned once as well (``covariate_bins_<max_bin>/``), and slices the shared
+codes instead of binning again.
+
+The cut points are computed from all samples.  No labels are used, but the
+test fold does contribute to the bin edges, exactly as it would in a
+``xgb.cv`` run on a pre-binned matrix.
+"""
+
+import os
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+import xgboost as xgb
+
+from .matrix import COVARIATES
+
+MISSING = 255
+
+
+def quantile_cuts(X, max_bin=255):
+    """(n_features, max_bin - 1) float32 interior quantiles of each column, NaN ignored."""
+    if not 2 <= max_bin <= MISSING:
+        raise ValueError('max_bin must be in [2, %d]' % MISSING)
+    qs = np.linspace(0, 1, max_bin + 1)[1:-1]
+    return np.nanquantile(np.asarray(X, dtype=np.float32), qs, axis=0).T.astype(np.float32)
+
+
+def bin_codes(X, cuts, out=None):
+    """uint8 bin index of every value (``MISSING`` for NaN)."""
+    n_data, n_features = X.shape
+    if out is None:
+        out = np.empty((n_data, n_features), dtype=np.uint8)
+    for j in range(n_features):
+        col = np.asarray(X[:, j])
+        c = np.searchsorted(cuts[j], col, side='right')
+        c[np.isnan(col)] = MISSING
+        out[:, j] = c
+    return out
+
+
+_REFS = {}
+
+
+def reference(n_features, max_bin):
+    """Reference QuantileDMatrix for `n_features` columns of bin codes (memoised)."""
+    key = n_features, max_bin
+    if key not in _REFS:
+        every_code = np.repeat(np.arange(max_bin, dtype=np.uint8)[:, None], n_features, axis=1)
+        _REFS[key] = xgb.QuantileDMatrix(every_code, missing=MISSING, max_bin=max_bin)
+    return _REFS[key]
+
+
+@dataclass
+class BinnedMatrix:
+    """Bin codes (n_data, n_features) uint8 and the cut points they index."""
+    codes: np.ndarray
+    cuts: np.ndarray
+    feature_names: np.ndarray
+    max_bin: int
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def concat(self, other):
+        """Columns of `self` followed by those of `other` (same rows and max_bin)."""
+        return BinnedMatrix(np.hstack([self.codes, other.codes]), np.vstack([self.cuts, other.cuts]),
+                            np.concatenate([self.feature_names, other.feature_names]), self.max_bin)
+
+    def columns(self, cols):
+        """Binned matrix restricted to column indices `cols` (same cut points)."""
+        cols = np.asarray(cols)
+        return BinnedMatrix(np.ascontiguousarray(self.codes[:, cols]), self.cuts[cols],
+                            self.feature_names[cols], self.max_bin)
+
+    def reference(self, n_features=None):
+        """QuantileDMatrix whose cut points every matrix of `n_features` columns reuses."""
+        return reference(self.shape[1] if n_features is None else n_features, self.max_bin)
+
+    def take(self, idx, label=None, cols=None):
+        """QuantileDMatrix of rows `idx`, restricted to column indices `cols` if given;
+        `label` is aligned with `idx`."""
+        idx = np.asarray(idx)
+        names = self.feature_names
+        if cols is None:
+            codes = self.codes[idx]
+        else:
+            cols = np.asarray(cols)
+            codes = self.codes[idx[:, None], cols]
+            names = names[cols]
+        return xgb.QuantileDMatrix(
+            codes, label=label, feature_names=[str(f) for f in names],
+            missing=MISSING, max_bin=self.max_bin, ref=self.reference(codes.shape[1]))
+
+    def rows(self, idx, y=None):
+        idx = np.asarray(idx)
+        return self.take(idx, None if y is None else np.asarray(y)[idx])
+
+    def fold(self, tr, te, y):
+        return self.rows(tr, y), self.rows(te, y)
+
+
+_BINNED = {}
+
+
+def _cached_bins(path, X, feature_names, max_bin):
+    if path in _BINNED:
+        return _BINNED[path]
+    if not os.path.exists(path):
+        tmp = path + '.tmp%d' % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        cuts = quantile_cuts(X, max_bin)
+        codes = np.lib.format.open_memmap(os.path.join(tmp, 'codes.npy'), mode='w+',
+                                          dtype=np.uint8, shape=X.shape)
+        bin_codes(X, cuts, out=codes)
+        codes.flush()
+        del codes
+        np.save(os.path.join(tmp, 'cuts.npy'), cuts)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # another process finished the same bins first
+            shutil.rmtree(tmp, ignore_errors=True)
+    _BINNED[path] = BinnedMatrix(np.load(os.path.join(path, 'codes.npy'), mmap_mode='r'),
+                                 np.load(os.path.join(path, 'cuts.npy')),
+                                 np.asarray(feature_names), max_bin)
+    return _BINNED[path]
+
+
+def binned(matrix, max_bin=255):
+    """Binned form of a `CohortMatrix`, cached as ``bins_<max_bin>/`` in its bundle.
+
+    Within a process the same `BinnedMatrix` is returned for every
+    experiment on the bundle.
+    """
+    return _cached_bins(os.path.join(matrix.path, 'bins_%d' % max_bin), matrix.X,
+                        matrix.feature_names, max_bin)
+
+
+def binned_covariates(matrix, max_bin=255):
+    """Binned sex / age columns, cached as ``covariate_bins_<max_bin>/`` in the bundle."""
+    if matrix.covariates is None:
+        raise ValueError('bundle has no covariates; rebuild it with materialize()')
+    return _cached_bins(os.path.join(matrix.path, 'covariate_bins_%d' % max_bin), matrix.covariates,
+                        np.array(COVARIATES, dtype=object), max_bin)
@@ -0,0 +1,74 @@
+"""Bootstrap confidence intervals on out-of-fold predictions.
+
+One (n_boot, n_data) resample index matrix is drawn up front; labels and
+scores are gathered through it and every metric is computed for all
+resamples at once with the batched kernels of `cov19ml.metrics`.  Works on
+the predictions of any run in an `OOFStore` or on plain arrays.
+
+    oof = OOFStore(root).read('xgb_2class_all', seeds=[0])
+    print(oof_ci(oof).to_markdown())
+"""
+
+import numpy as np
+import pandas as pd
+
+from .metrics import score_auc, threshold_metrics
+
+
+def resample_index(n, n_boot=2000, seed=0, strata=None):
+    """(n_boot, n) bootstrap indices; with `strata`, each stratum keeps its size."""
+    rng = np.random.default_rng(seed)
+    if strata is None:
+        return rng.integers(0, n, size=(n_boot, n))
+    strata = np.asarray(strata)
+    idx = np.empty((n_boot, n), dtype=np.intp)
+    start = 0
+    for s in np.unique(strata):
+        members = np.flatnonzero(strata == s)
+        idx[:, start:start + len(members)] = members[rng.integers(0, len(members), size=(n_boot, len(members)))]
+        start += len(members)
+    return idx
+
+
+def metric_stack(y, prob, n_class, threshold=0.5):
+    """All metrics for a stack of (labels, predictions) resamples, as arrays over the stack."""
+    _, m = threshold_metrics(y, prob, n_class, threshold)
+    out = {'auc': score_auc(y, prob, n_class)}
+    out.update(m)
+    return out
+
+
+def bootstrap(y, prob, n_class, n_boot=2000, seed=0, threshold=0.5, stratify=True):
+    """Metric values for `n_boot` resamples (dict of (n_boot,) arrays).
+
+    Resampling is stratified by label by default so that every resample
+    contains every class and AUC stays defined.
+    """
+    y = np.asarray(y)
+    prob = np.asarray(prob)
+    idx = resample_index(len(y), n_boot, seed, y if stratify else None)
+    return metric_stack(y[idx], prob[idx], n_class, threshold)
+
+
+def bootstrap_ci(y, prob, n_class, n_boot=2000, seed=0, alpha=0.05, threshold=0.5, stratify=True):
+    """Point estimate, bootstrap std and percentile CI per metric."""
+    point = metric_stack(np.asarray(y), np.asarray(prob), n_class, threshold)
+    boot = bootstrap(y, prob, n_class, n_boot, seed, threshold, stratify)
+    rows = {}
+    for k, v in boot.items():
+        lo, hi = np.nanquantile(v, [alpha / 2, 1 - alpha / 2])
+        rows[k] = {'estimate': float(point[k]), 'std': float(np.nanstd(v, ddof=1)),
+                   'ci_low': lo, 'ci_high': hi}
+    return pd.DataFrame(rows).T
+
+
+def oof_ci(df, seed=None, **kwargs):
+    """`bootstrap_ci` of the pooled out-of-fold predictions of one seed of an `OOFStore` frame."""
+    if seed is None:
+        seed = df['seed'].iloc[0]
+    g = df[df['seed'] == seed]
+    cols = [c for c in g.columns if c.startswith('prob')]
+    n_class = 2 if cols == ['prob'] else len(cols)
+    prob = g[cols].to_numpy()
+    prob = prob[:, 0] if n_class == 2 else prob
+    return bootstrap_ci(g['y'].to_numpy(), prob, n_class, **kwargs)
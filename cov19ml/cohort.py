@@ -0,0 +1,193 @@
+"""Shared loader for the per-disease antigen tables.
+
+The ExtTab3 / ExtTab4 / ExtFig5 scripts all start from the same six CSVs
+(AAV_data_3.csv ... SSc_data_3.csv), concatenate them and split off the
+metadata columns.  `load_cohort` does that once per data drop and keeps the
+concatenated table as a Parquet file keyed by the content hash of the CSVs,
+so later runs only read the cache.
+
+    from cov19ml.cohort import load_cohort
+    cohort = load_cohort('/content/drive/MyDrive/COV19ML_share/data_20250201/')
+    X, y_covid, y_all, feature_names = cohort.X, cohort.y_covid, cohort.y_all, cohort.feature_names
+"""
+
+import hashlib
+import json
+import os
+import warnings
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+DISEASES = ['AAV', 'AD', 'COVID', 'HC', 'SLE', 'SSc']
+META_COLUMNS = ['ID', 'sex', 'age', 'CLASS', 'COVID']
+CACHE_DIR_NAME = '.cov19ml_cache'
+
+
+def source_files(dir_name):
+    """Paths of the six per-disease CSVs, in the order the scripts concatenate them."""
+    return [os.path.join(dir_name, d + '_data_3.csv') for d in DISEASES]
+
+
+def _file_digest(path, index):
+    # sha256 of the file contents; reused from `index` while size and mtime are unchanged
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    entry = index.get(path)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha256']
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    index[path] = {'stamp': stamp, 'sha256': h.hexdigest()}
+    return index[path]['sha256']
+
+
+def data_key(paths, cache_dir=None):
+    """Content hash identifying a data drop (the ordered set of source CSVs)."""
+    index_path = os.path.join(cache_dir, 'digests.json') if cache_dir else None
+    index = {}
+    if index_path and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    before = json.dumps(index, sort_keys=True)
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        h.update(_file_digest(path, index).encode())
+    if index_path and json.dumps(index, sort_keys=True) != before:
+        _atomic_write_text(index_path, json.dumps(index, indent=1))
+    return h.hexdigest()[:16]
+
+
+def _atomic_write_text(path, text):
+    tmp = path + '.tmp%d' % os.getpid()
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _have_parquet():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass
+class Cohort:
+    """Concatenated cohort split into antigen matrix and labels.
+
+    `X` holds only the antigen columns (the scripts' ``data.drop(columns=META_COLUMNS)``),
+    `meta` the ID / sex / age / CLASS / COVID columns, `key` the data-drop hash
+    and `cache_dir` the directory holding its cache files.
+    """
+    X: pd.DataFrame
+    meta: pd.DataFrame
+    key: str
+    cache_dir: str = None
+    _labels: dict = field(default_factory=dict, init=False, repr=False)
+
+    @classmethod
+    def from_frame(cls, data, key, cache_dir=None):
+        data = data.reset_index(drop=True)
+        meta_cols = [c for c in META_COLUMNS if c in data.columns]
+        return cls(X=data.drop(columns=meta_cols), meta=data[meta_cols], key=key,
+                   cache_dir=cache_dir)
+
+    @property
+    def y_covid(self):
+        return self.meta['COVID'].to_numpy()
+
+    @property
+    def y_all(self):
+        return self.meta['CLASS'].to_numpy()
+
+    @property
+    def ids(self):
+        return self.meta['ID'].to_numpy()
+
+    @property
+    def feature_names(self):
+        return np.asarray(self.X.columns, dtype=object)
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    def labels(self, scheme):
+        """Integer targets and class names for a label scheme, computed once per cohort."""
+        from .labels import encode
+        name = scheme if isinstance(scheme, str) else scheme.name
+        if name not in self._labels:
+            self._labels[name] = encode(self.y_all, scheme)
+        return self._labels[name]
+
+    def shared_matrix(self, cache_dir=None):
+        """Read-only float32 memory map of this cohort (see `cov19ml.matrix`)."""
+        from .matrix import attach, materialize
+        return attach(materialize(self, cache_dir))
+
+
+def _project(columns, available):
+    missing = [c for c in columns if c not in available]
+    if missing:
+        raise KeyError('columns not in the cohort: %s' % missing)
+    return [c for c in META_COLUMNS if c in available] + list(columns)
+
+
+def _panel_key(key, columns):
+    # a projected cohort gets its own key so its derived caches do not collide with the full one
+    if columns is None:
+        return key
+    return key + '_' + hashlib.sha256('\0'.join(columns).encode()).hexdigest()[:8]
+
+
+def load_cohort(dir_name, cache_dir=None, use_cache=True, columns=None):
+    """Load the six per-disease CSVs under `dir_name` as a `Cohort`.
+
+    The concatenated table is cached as ``<cache_dir>/cohort_<key>.parquet``
+    (default ``<dir_name>/.cov19ml_cache``).  A changed CSV changes the key,
+    so a new data drop is parsed once and then served from its own cache file.
+    Without pyarrow the CSVs are parsed on every call.
+
+    `columns` restricts `X` to the listed antigens (e.g. ``["BCORP1", "KAT2A"]``);
+    only those and the metadata columns are read from the cache, or from the
+    CSVs when the cache is off.
+    """
+    paths = source_files(dir_name)
+    if columns is not None:
+        columns = list(columns)
+    if use_cache and not _have_parquet():
+        warnings.warn('pyarrow is not installed; cohort cache disabled')
+        use_cache = False
+    if not use_cache:
+        usecols = None
+        if columns is not None:
+            usecols = _project(columns, pd.read_csv(paths[0], nrows=0).columns)
+        data = pd.concat([pd.read_csv(p, usecols=usecols) for p in paths])
+        if usecols is not None:
+            data = data[usecols]
+        return Cohort.from_frame(data, _panel_key(data_key(paths), columns))
+
+    if cache_dir is None:
+        cache_dir = os.path.join(dir_name, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = data_key(paths, cache_dir)
+    cache_path = os.path.join(cache_dir, 'cohort_' + key + '.parquet')
+    if not os.path.exists(cache_path):
+        data = pd.concat([pd.read_csv(p) for p in paths]).reset_index(drop=True)
+        tmp = cache_path + '.tmp%d' % os.getpid()
+        data.to_parquet(tmp, index=False)
+        os.replace(tmp, cache_path)
+        if columns is None:
+            return Cohort.from_frame(data, key, cache_dir)
+    read_cols = None
+    if columns is not None:
+        import pyarrow.parquet as pq
+        read_cols = _project(columns, pq.read_schema(cache_path).names)
+    data = pd.read_parquet(cache_path, columns=read_cols)
+    return Cohort.from_frame(data, _panel_key(key, columns), cache_dir)
@@ -0,0 +1,142 @@
+"""Per-sample TreeSHAP attributions of the CV boosters, cached on disk.
+
+Split-count importance says how often an antigen is used, not how much it
+moves each prediction.  `shap_stage` runs ``Booster.predict(pred_contribs=True)``
+for the test rows of every fold (in the engine's worker processes when given
+a `CoreBudget`) and writes them into one float32 memory-mapped file per
+experiment, ``<root>/<experiment>/contribs.npy`` of shape
+(n_data, n_features + 1) -- or (n_data, n_class, n_features + 1) for
+multiclass -- whose last column is the bias term.  Each sample is attributed
+by the booster that did not see it.  Rankings and summary tables are read
+from the cache without recomputation.  Each fold's done marker records a
+digest of the booster it was computed from, so retrained boosters (other
+parameters or num_round) under the same experiment name are recomputed.
+
+    cache = shap_stage(engine, outputs, 'shap_cache', 'xgb_2class_all', budget=CoreBudget())
+    cache.ranking().head(10)
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+
+def _contrib_shape(engine):
+    n_data, n_features = engine.shape
+    if engine.n_class == 2:
+        return (n_data, n_features + 1)
+    return (n_data, engine.n_class, n_features + 1)
+
+
+def model_digest(raw):
+    return hashlib.sha256(bytes(raw)).hexdigest()
+
+
+def _is_done(path, i, digest):
+    marker = os.path.join(path, 'fold%d.done' % i)
+    if not os.path.exists(marker):
+        return False
+    with open(marker) as f:
+        return f.read().strip() == digest
+
+
+def _write_fold(engine, i, raw, path, nthread=None):
+    bst = xgb.Booster(model_file=bytearray(raw))
+    if nthread is not None:
+        bst.set_param({'nthread': nthread})
+    _, dtest = engine.fold_matrices(i)
+    contribs = bst.predict(dtest, pred_contribs=True)
+    out = np.load(os.path.join(path, 'contribs.npy'), mmap_mode='r+')
+    out[engine.folds[i][1]] = contribs
+    out.flush()
+    del out
+    with open(os.path.join(path, 'fold%d.done' % i), 'w') as f:
+        f.write(model_digest(raw))
+    return i
+
+
+def _fold_job(i, raw, path, nthread):
+    from . import cv
+    return _write_fold(cv._ENGINE, i, raw, path, nthread)
+
+
+@dataclass
+class ShapCache:
+    contribs: np.ndarray
+    feature_names: np.ndarray
+    X: np.ndarray
+
+    @classmethod
+    def load(cls, root, experiment, engine):
+        path = os.path.join(root, experiment)
+        return cls(np.load(os.path.join(path, 'contribs.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'feature_names.npy')), engine.X)
+
+    def values(self):
+        """(n_data, [n_class,] n_features) attributions without the bias column."""
+        return self.contribs[..., :-1]
+
+    def ranking(self):
+        """Mean |SHAP| per feature (over samples and classes), sorted."""
+        v = np.abs(self.values())
+        mean = v.mean(axis=tuple(range(v.ndim - 1)))
+        return pd.DataFrame({'mean_abs_shap': mean}, index=self.feature_names) \
+            .sort_values(by='mean_abs_shap', ascending=False)
+
+    def summary_frame(self, features, class_index=None):
+        """Long table (feature, shap, value) for beeswarm / dependence plots."""
+        v = self.values()
+        if v.ndim == 3:
+            v = v[:, class_index or 0]
+        names = list(self.feature_names)
+        frames = []
+        for f in features:
+            j = names.index(f)
+            frames.append(pd.DataFrame({'feature': f, 'shap': np.asarray(v[:, j]),
+                                        'value': np.asarray(self.X[:, j])}))
+        return pd.concat(frames, ignore_index=True)
+
+
+def shap_stage(engine, outputs, root, experiment, budget=None):
+    """TreeSHAP of every fold's test rows, cached under ``<root>/<experiment>``.
+
+    Folds already marked done for the same booster (by model digest) are
+    skipped, so rerunning only fills in what is missing or stale.  The cache is rebuilt if its recorded setup
+    (data key, scheme, folds seed, shape) differs from `engine`.
+    """
+    path = os.path.join(root, experiment)
+    shape = _contrib_shape(engine)
+    meta = {'key': engine.key, 'scheme': str(engine.scheme), 'seed': engine.seed,
+            'n_fold': engine.n_fold, 'shape': list(shape)}
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) != meta:
+                for name in os.listdir(path):
+                    os.remove(os.path.join(path, name))
+    if not os.path.exists(os.path.join(path, 'contribs.npy')):
+        os.makedirs(path, exist_ok=True)
+        out = np.lib.format.open_memmap(os.path.join(path, 'contribs.npy'), mode='w+',
+                                        dtype=np.float32, shape=shape)
+        out[:] = np.nan
+        out.flush()
+        del out
+        np.save(os.path.join(path, 'feature_names.npy'), engine.feature_names.astype(str))
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    raws = {o.fold: o.bst.save_raw() for o in outputs}
+    todo = [i for i, raw in raws.items() if not _is_done(path, i, model_digest(raw))]
+    if budget is None or len(todo) <= 1:
+        for i in todo:
+            _write_fold(engine, i, raws[i], path)
+    else:
+        budget = budget.resolve(len(todo))
+        with engine.pool(budget.fold_workers) as ex:
+            for job in [ex.submit(_fold_job, i, raws[i], path, budget.nthread) for i in todo]:
+                job.result()
+    return ShapCache.load(root, experiment, engine)
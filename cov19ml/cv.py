@@ -0,0 +1,399 @@
+"""Cross-validation engine for the xgboost experiments.
+
+The scripts rebuild ``xgb.DMatrix(pd.DataFrame(X_np[tr], columns=feature_names))``
+in every fold.  `CohortDMatrix` builds one DMatrix for the whole cohort and
+hands out fold views with ``DMatrix.slice``, so feature-name validation and
+the float conversion happen once per experiment and pandas is never touched.
+
+    engine = CVEngine(cohort.shared_matrix(), scheme='covid2')
+    for out in engine.run(binary_param, num_round=100):
+        ...
+
+Folds can also be dispatched to a process pool (``budget=CoreBudget(...)``);
+each worker attaches to the memory-mapped cohort bundle rather than
+receiving a copy of the matrix.  Workers do not build the cohort DMatrix
+(xgboost keeps a private copy of it for the worker's lifetime); they build
+each fold's train / test DMatrix from the mapped rows and drop it after the
+fold.
+"""
+
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import StratifiedKFold
+
+from .importance import IMPORTANCE_TYPES, importance_matrix
+from .metrics import score_auc, threshold_metrics
+
+METRICS = ['accuracy', 'auc', 'recall', 'precision', 'f1_score', 'mcc']
+
+
+def cv_folds(strata, n_fold=10, seed=0):
+    """(tr, te) index pairs of the scripts' ``StratifiedKFold(shuffle=True, random_state=seed)``."""
+    strata = np.asarray(strata)
+    skf = StratifiedKFold(n_splits=n_fold, shuffle=True, random_state=seed)
+    return [(tr, te) for tr, te in skf.split(np.zeros((len(strata), 1)), strata)]
+
+
+def binary_param(y_tr, n_class=2, eta=0.05, **kwargs):
+    """ExtTab3 2-class parameters; scale_pos_weight follows the training fold."""
+    param = {'objective': 'binary:logistic', 'eta': eta, 'subsample': 0.5,
+             'max_depth': 5, 'scale_pos_weight': np.sum(y_tr == 0) / np.sum(y_tr == 1),
+             'reg_alpha': 1e-3, 'reg_lambda': 1e-3,
+             'eval_metric': ['error', 'auc', 'logloss']}
+    param.update(kwargs)
+    return param
+
+
+def multiclass_param(y_tr, n_class, eta=0.05, **kwargs):
+    """ExtTab3 3-/7-class parameters."""
+    param = {'objective': 'multi:softprob', 'num_class': n_class, 'eta': eta,
+             'subsample': 0.5, 'eval_metric': ['merror', 'mlogloss']}
+    param.update(kwargs)
+    return param
+
+
+def fold_metrics(y, prob, n_class):
+    """The scripts' metric set for one split (0.5 cut or argmax, macro averages) and its confusion matrix."""
+    cm, m = threshold_metrics(y, prob, n_class)
+    metrics = {'accuracy': m['accuracy'], 'auc': score_auc(y, prob, n_class), 'recall': m['recall'],
+               'precision': m['precision'], 'f1_score': m['f1_score'], 'mcc': m['mcc']}
+    return {k: float(v) for k, v in metrics.items()}, cm
+
+
+@dataclass
+class CoreBudget:
+    """Split `n_cores` between fold-level worker processes and xgboost threads.
+
+    Unset fields are filled in by `resolve`: by default one worker per fold
+    (up to `n_cores`) and the remaining cores as each booster's nthread.
+    """
+    n_cores: int = field(default_factory=os.cpu_count)
+    fold_workers: int = None
+    nthread: int = None
+
+    def resolve(self, n_fold):
+        workers = self.fold_workers or max(1, min(n_fold, self.n_cores))
+        nthread = self.nthread or max(1, self.n_cores // workers)
+        return CoreBudget(self.n_cores, workers, nthread)
+
+
+class CohortDMatrix:
+    """A single DMatrix over the whole cohort; folds are index slices of it."""
+
+    def __init__(self, X, y, feature_names=None):
+        if feature_names is not None:
+            feature_names = [str(f) for f in feature_names]
+        self.dmat = xgb.DMatrix(np.asarray(X), label=np.asarray(y), feature_names=feature_names)
+
+    @property
+    def feature_names(self):
+        return self.dmat.feature_names
+
+    def rows(self, idx):
+        return self.dmat.slice(np.asarray(idx))
+
+    def fold(self, tr, te):
+        return self.rows(tr), self.rows(te)
+
+
+@dataclass
+class FoldOutput:
+    fold: int
+    tr: np.ndarray
+    te: np.ndarray
+    bst: xgb.Booster
+    pred_tr: np.ndarray
+    pred_te: np.ndarray
+    metrics: dict
+    confusion: dict
+    importance: np.ndarray  # (n_type, n_feature), types as in importance.IMPORTANCE_TYPES
+    curves: dict = None
+
+
+class CVEngine:
+    """Stratified k-fold xgboost runs over one cohort matrix.
+
+    `matrix` is a `CohortMatrix` (or anything with X / y_all / feature_names
+    and ``labels(scheme)``).  Folds are stratified on the full CLASS column,
+    as in the scripts, while the targets come from `scheme`.
+
+    With `max_bin` set, folds train on the shared quantile bins of
+    `cov19ml.binning` (``tree_method='hist'``) instead of the float matrix.
+
+    The ExtTab3 ablation variants run on the same matrix and bins:
+    `rows` (boolean mask or indices) keeps a subset of samples, e.g.
+    ``matrix.y_all != 'COVID_severe'``; `columns` (antigen names or indices)
+    a subset of antigens; ``covariates=True`` appends sex and age as
+    features.  Folds, targets and fold indices then refer to the kept rows.
+    """
+
+    def __init__(self, matrix, scheme='covid2', n_fold=10, seed=0, max_bin=None,
+                 rows=None, columns=None, covariates=False):
+        self.matrix = matrix
+        self.scheme = scheme
+        self.rows = _as_index(rows, len(matrix.y_all))
+        self.columns = _column_index(columns, matrix.feature_names)
+        self.covariates = bool(covariates)
+        if self.rows is None:
+            self.y, self.classes = matrix.labels(scheme)
+        else:
+            from .labels import encode
+            self.y, self.classes = encode(np.asarray(matrix.y_all)[self.rows], scheme)
+        self.y = np.asarray(self.y)
+        self.n_class = len(self.classes)
+        self.n_fold = n_fold
+        self.seed = seed
+        self.folds = cv_folds(self.y_all, n_fold, seed)
+        self._dmatrix = None
+        self._X = None
+        # serial runs slice one cohort DMatrix; pool workers set this to False
+        self.slice_cohort = True
+        self.max_bin = max_bin
+        self.binned = None
+        if max_bin is not None:
+            from .binning import binned, binned_covariates
+            self.binned = binned(matrix, max_bin)
+            if self.columns is not None:
+                self.binned = self.binned.columns(self.columns)
+            if self.covariates:
+                self.binned = self.binned.concat(binned_covariates(matrix, max_bin))
+
+    @property
+    def subset(self):
+        """True when the engine uses only part of the cohort matrix or adds covariates."""
+        return self.rows is not None or self.columns is not None or self.covariates
+
+    @property
+    def key(self):
+        """Data key of the matrix, suffixed with a digest of the row / column / covariate subset."""
+        if not self.subset:
+            return self.matrix.key
+        h = hashlib.sha256()
+        for part in (self.rows, self.columns):
+            h.update(b'-' if part is None else np.ascontiguousarray(part, dtype=np.int64).tobytes())
+        h.update(b'cov' if self.covariates else b'')
+        return self.matrix.key + '_' + h.hexdigest()[:8]
+
+    @property
+    def y_all(self):
+        y_all = np.asarray(self.matrix.y_all)
+        return y_all if self.rows is None else y_all[self.rows]
+
+    @property
+    def ids(self):
+        ids = np.asarray(self.matrix.ids)
+        return ids if self.rows is None else ids[self.rows]
+
+    @property
+    def feature_names(self):
+        names = np.asarray(self.matrix.feature_names)
+        if self.columns is not None:
+            names = names[self.columns]
+        if self.covariates:
+            from .matrix import COVARIATES
+            names = np.concatenate([names, np.array(COVARIATES, dtype=names.dtype)])
+        return names
+
+    @property
+    def shape(self):
+        return (len(self.y), len(self.feature_names))
+
+    @property
+    def X(self):
+        """Float feature matrix of the engine (the memory map itself unless `subset`)."""
+        if not self.subset:
+            return self.matrix.X
+        if self._X is None:
+            self._X = self.take(np.arange(len(self.y)))
+        return self._X
+
+    def take(self, idx, cols=None):
+        """float32 rows `idx` and engine feature indices `cols`, gathered from the memory map."""
+        rows = np.asarray(idx) if self.rows is None else self.rows[idx]
+        antigens = np.arange(self.matrix.shape[1]) if self.columns is None else self.columns
+        cols = np.arange(len(self.feature_names)) if cols is None else np.asarray(cols)
+        out = np.empty((len(rows), len(cols)), dtype=np.float32)
+        is_ag = cols < len(antigens)
+        out[:, is_ag] = self.matrix.X[np.ix_(rows, antigens[cols[is_ag]])]
+        if not is_ag.all():
+            out[:, ~is_ag] = self.matrix.covariates[np.ix_(rows, cols[~is_ag] - len(antigens))]
+        return out
+
+    @property
+    def dmatrix(self):
+        if self._dmatrix is None:
+            self._dmatrix = CohortDMatrix(self.X, self.y, self.feature_names)
+        return self._dmatrix
+
+    def spec(self):
+        # enough to rebuild this engine in a worker process
+        path = getattr(self.matrix, 'path', None)
+        if path is None:
+            raise ValueError('process-pool runs need a CohortMatrix (cohort.shared_matrix())')
+        return (path, self.scheme, self.n_fold, self.seed, self.max_bin,
+                self.rows, self.columns, self.covariates)
+
+    def param_for(self, param, y_tr, nthread=None):
+        # `param` is a dict or a callable (y_tr, n_class), e.g. `binary_param`
+        if callable(param):
+            p = param(y_tr, self.n_class)
+        else:
+            p = dict(param)
+        if nthread is not None:
+            p['nthread'] = nthread
+        if self.binned is not None:
+            p.update(tree_method='hist', max_bin=self.max_bin)
+        return p
+
+    def fold_matrices(self, i, y=None, cols=None):
+        """Train / test matrices of fold `i`, labelled with `y` (default: the scheme's targets).
+
+        `cols` restricts them to a subset of feature indices (binned engines
+        keep the cohort-wide cut points of those columns).
+        """
+        tr, te = self.folds[i]
+        if y is None:
+            y = self.y
+        if self.binned is not None:
+            labels = y[tr], y[te]
+            if self.rows is not None:
+                tr, te = self.rows[tr], self.rows[te]
+            return self.binned.take(tr, labels[0], cols), self.binned.take(te, labels[1], cols)
+        if cols is not None or not self.slice_cohort:
+            cols = None if cols is None else np.asarray(cols)
+            names = [str(f) for f in (self.feature_names if cols is None else self.feature_names[cols])]
+            return (xgb.DMatrix(self.take(tr, cols), label=y[tr], feature_names=names),
+                    xgb.DMatrix(self.take(te, cols), label=y[te], feature_names=names))
+        dtrain, dtest = self.dmatrix.fold(tr, te)
+        if y is not self.y:
+            dtrain.set_label(y[tr])
+            dtest.set_label(y[te])
+        return dtrain, dtest
+
+    def train_fold(self, i, param, num_round, nthread=None, curves=False, y=None, cols=None):
+        """Train fold `i`; `y` replaces the targets (e.g. shuffled labels) for this fold only,
+        `cols` trains on a subset of feature indices."""
+        if y is None:
+            y = self.y
+        tr, te = self.folds[i]
+        dtrain, dtest = self.fold_matrices(i, y, cols)
+        p = self.param_for(param, y[tr], nthread)
+        bst = xgb.train(p, dtrain, num_round)
+        pred_tr, pred_te = bst.predict(dtrain), bst.predict(dtest)
+        metrics, confusion = {}, {}
+        for split, idx, pred in [('train', tr, pred_tr), ('test', te, pred_te)]:
+            m, confusion[split] = fold_metrics(y[idx], pred, self.n_class)
+            for k, v in m.items():
+                metrics[split + '_' + k] = v
+        if cols is None:
+            importance = importance_matrix(bst, self.feature_names)
+        else:
+            # keep importances full-width so subset runs stack with full ones
+            importance = np.zeros((len(IMPORTANCE_TYPES), len(self.feature_names)))
+            importance[:, cols] = importance_matrix(bst, self.feature_names[cols])
+        out = FoldOutput(i, tr, te, bst, pred_tr, pred_te, metrics, confusion, importance)
+        if curves:
+            from .rounds import margins_to_prob, round_curves, round_margins
+            out.curves = {}
+            for split, idx, dmat in [('train', tr, dtrain), ('test', te, dtest)]:
+                prob = margins_to_prob(round_margins(bst, dmat, num_round), self.n_class)
+                out.curves[split] = round_curves(y[idx], prob, self.n_class)
+        return out
+
+    def run(self, param, num_round, budget=None, curves=False):
+        """Train one booster per fold; yields a `FoldOutput` per fold in order.
+
+        With ``curves=True`` each output also carries per-round train/test
+        metric curves for every prefix of its booster (`cov19ml.rounds`), so
+        num_round can be chosen afterwards with ``rounds.cv_curves``.
+
+        Without `budget` the folds run serially in this process.  With a
+        `CoreBudget` they are spread over ``fold_workers`` processes, each
+        training with ``nthread`` threads.  `param` must then be picklable
+        (a dict or a module-level function such as `binary_param`).
+        ``budget='auto'`` uses the layout calibrated for this host and data
+        shape (see `cov19ml.layout`).
+        """
+        if budget == 'auto':
+            from .layout import tuned_budget
+            budget = tuned_budget(self, param, num_round)
+        if budget is None:
+            for i in range(self.n_fold):
+                yield self.train_fold(i, param, num_round, curves=curves)
+            return
+        budget = budget.resolve(self.n_fold)
+        if budget.fold_workers == 1:
+            for i in range(self.n_fold):
+                yield self.train_fold(i, param, num_round, budget.nthread, curves)
+            return
+        with self.pool(budget.fold_workers) as ex:
+            jobs = [ex.submit(_train_fold, i, param, num_round, budget.nthread, curves)
+                    for i in range(self.n_fold)]
+            for job in jobs:
+                yield job.result()
+
+    def results(self, outputs):
+        """Array-backed `FoldResults` of a run's outputs."""
+        from .results import FoldResults
+        return FoldResults.from_outputs(outputs, self.feature_names, self.n_class)
+
+    def collect(self, param, num_round, store=None, experiment=None, **kwargs):
+        """`run` to completion; with an `OOFStore` also persist the out-of-fold predictions."""
+        outputs = list(self.run(param, num_round, **kwargs))
+        if store is not None:
+            if experiment is None:
+                raise ValueError('an experiment key is required to store predictions')
+            store.write_run(experiment, self, outputs)
+        return outputs
+
+    def pool(self, workers):
+        """Process pool whose workers each hold an engine attached to the same bundle."""
+        # spawn, not fork: forking a process that already ran OpenMP threads can hang
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=self.spec())
+
+
+def _as_index(rows, n):
+    if rows is None:
+        return None
+    rows = np.asarray(rows)
+    if rows.dtype == bool:
+        if len(rows) != n:
+            raise ValueError('row mask has %d entries for %d samples' % (len(rows), n))
+        return np.flatnonzero(rows)
+    return rows.astype(np.intp)
+
+
+def _column_index(columns, feature_names):
+    if columns is None:
+        return None
+    names = [str(f) for f in feature_names]
+    index = []
+    for c in columns:
+        if isinstance(c, (int, np.integer)):
+            index.append(int(c))
+        elif str(c) in names:
+            index.append(names.index(str(c)))
+        else:
+            raise KeyError('column not in the cohort matrix: %r' % (c,))
+    return np.asarray(index, dtype=np.intp)
+
+
+_ENGINE = None
+
+
+def _init_worker(path, scheme, n_fold, seed, max_bin, rows=None, columns=None, covariates=False):
+    global _ENGINE
+    from .matrix import attach
+    _ENGINE = CVEngine(attach(path), scheme, n_fold, seed, max_bin, rows, columns, covariates)
+    _ENGINE.slice_cohort = False
+
+
+def _train_fold(i, param, num_round, nthread, curves=False):
+    return _ENGINE.train_fold(i, param, num_round, nthread, curves)
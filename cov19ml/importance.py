@@ -0,0 +1,117 @@
+"""Dense per-fold feature importances for every xgboost importance type.
+
+The scripts accumulate importance with
+``for k, v in zip(bst.get_fscore().keys(), bst.get_fscore().values()): df.at[k, ...] += v``,
+calling get_fscore twice per fold and writing one pandas cell per feature.
+`importance_matrix` turns one ``get_score`` call per importance type into a
+dense row with a single indexed assignment; `ImportanceStack` holds the
+(type x fold x feature) array and produces the mean / std ranking tables.
+
+Split counts favour antigens with many distinct values, so
+`permutation_importance` also measures the drop in a test-fold metric when
+each column is shuffled, predicting all shuffled copies in large batches.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+IMPORTANCE_TYPES = ('weight', 'gain', 'cover', 'total_gain', 'total_cover')
+
+
+def importance_matrix(bst, feature_names, types=IMPORTANCE_TYPES):
+    """(n_type, n_feature) importances of one booster; unused features are 0."""
+    index = pd.Index([str(f) for f in feature_names])
+    out = np.zeros((len(types), len(index)))
+    for t, importance_type in enumerate(types):
+        score = bst.get_score(importance_type=importance_type)
+        if score:
+            out[t, index.get_indexer(list(score))] = list(score.values())
+    return out
+
+
+@dataclass
+class ImportanceStack:
+    """Importances of a CV run: ``values`` is (n_type, n_fold, n_feature)."""
+    values: np.ndarray
+    feature_names: np.ndarray
+    types: tuple = IMPORTANCE_TYPES
+
+    @classmethod
+    def collect(cls, boosters, feature_names, types=IMPORTANCE_TYPES):
+        values = np.stack([importance_matrix(b, feature_names, types) for b in boosters], axis=1)
+        return cls(values, np.asarray(feature_names), tuple(types))
+
+    def get(self, importance_type='weight'):
+        """(n_fold, n_feature) view for one importance type."""
+        return self.values[self.types.index(importance_type)]
+
+    def frame(self, importance_type='weight'):
+        """Feature x fold table (the scripts' ``pd.concat(imp_list, axis=1)``)."""
+        v = self.get(importance_type)
+        return pd.DataFrame(v.T, index=self.feature_names,
+                            columns=['feature_importance_cv%d' % i for i in range(v.shape[0])], copy=False)
+
+    def ranking(self, importance_type='weight'):
+        """``tmp_imp_stat``: mean / std (ddof=1) over folds, sorted by mean."""
+        v = self.get(importance_type)
+        stat = pd.DataFrame({'mean': v.mean(axis=0), 'std': v.std(axis=0, ddof=1)}, index=self.feature_names)
+        return stat.sort_values(by='mean', ascending=False)
+
+    def rankings(self):
+        """Mean importance of every type side by side, sorted by mean weight."""
+        means = pd.DataFrame(self.values.mean(axis=1).T, index=self.feature_names, columns=list(self.types))
+        return means.sort_values(by=self.types[0], ascending=False)
+
+
+def _model_input(engine):
+    # the matrix the boosters were trained on: bin codes for a binned engine
+    if engine.binned is not None:
+        from .binning import MISSING
+        codes = engine.binned.codes
+        return (codes if engine.rows is None else codes[engine.rows]), MISSING
+    return engine.X, np.nan
+
+
+def permutation_importance(bst, X_te, y_te, n_class, n_repeats=5, seed=0, metric='auc',
+                           missing=np.nan, max_elements=1 << 26):
+    """Drop in `metric` when each column of the test rows is permuted.
+
+    All (feature, repeat) copies of a chunk of columns are stacked into one
+    (copies * n_te, n_features) batch and predicted with a single
+    ``inplace_predict`` call; the metric is then computed for every copy at
+    once.  Chunks are sized to stay under `max_elements` matrix entries.
+    Returns (mean, std) over repeats, each of shape (n_features,).
+    """
+    from .bootstrap import metric_stack
+    X_te = np.asarray(X_te, dtype=np.float32)
+    y_te = np.asarray(y_te)
+    n_te, n_features = X_te.shape
+    rng = np.random.default_rng(seed)
+    perms = np.argsort(rng.random((n_repeats, n_te)), axis=1)
+    base = metric_stack(y_te, bst.inplace_predict(X_te, missing=missing), n_class)[metric]
+    chunk = max(1, max_elements // (n_repeats * n_te * n_features))
+    drops = np.empty((n_features, n_repeats))
+    for start in range(0, n_features, chunk):
+        cols = np.arange(start, min(start + chunk, n_features))
+        n_copy = len(cols) * n_repeats
+        batch = np.broadcast_to(X_te, (n_copy, n_te, n_features)).copy()
+        col = np.repeat(cols, n_repeats)
+        rows = np.tile(perms, (len(cols), 1))
+        batch[np.arange(n_copy)[:, None], np.arange(n_te)[None, :], col[:, None]] = X_te[rows, col[:, None]]
+        pred = bst.inplace_predict(batch.reshape(-1, n_features), missing=missing)
+        pred = pred.reshape((n_copy, n_te) + pred.shape[1:])
+        scores = metric_stack(y_te, pred, n_class)[metric]
+        drops[cols] = base - scores.reshape(len(cols), n_repeats)
+    return drops.mean(axis=1), drops.std(axis=1)
+
+
+def fold_permutation_importance(engine, outputs, n_repeats=5, seed=0, metric='auc', **kwargs):
+    """(n_fold, n_feature) permutation importance of each fold's booster on its test rows."""
+    X, missing = _model_input(engine)
+    out = np.empty((len(outputs), len(engine.feature_names)))
+    for k, o in enumerate(outputs):
+        out[k], _ = permutation_importance(o.bst, X[o.te], engine.y[o.te], engine.n_class,
+                                           n_repeats, seed + o.fold, metric, missing, **kwargs)
+    return out
@@ -0,0 +1,75 @@
+"""Named label schemes mapping the CLASS column to integer targets.
+
+The scripts derive their targets with per-element loops over ``y_all``
+(merging COVID_moderate / COVID_severe) followed by OneHotEncoder + argmax.
+Here each scheme only maps the handful of distinct CLASS values; the
+per-sample codes come from one categorical lookup.
+
+    y, classes = encode(cohort.y_all, 'covid3')
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+SEVERE = ('COVID_moderate', 'COVID_severe')
+
+
+@dataclass(frozen=True)
+class LabelScheme:
+    """`group` maps one CLASS value to its target class name; `classes` fixes
+    the code order (None sorts the names, like OneHotEncoder)."""
+    name: str
+    group: object
+    classes: tuple = None
+
+    def encode(self, y_all):
+        """Integer codes for `y_all` and the class name of each code."""
+        cat = pd.Categorical(np.asarray(y_all))
+        groups = [self.group(c) for c in cat.categories]
+        classes = list(self.classes) if self.classes is not None else sorted(set(groups))
+        lut = np.array([classes.index(g) for g in groups], dtype=np.int32)
+        return lut[cat.codes], classes
+
+
+def _covid2(c):
+    return 'COVID' if c.startswith('COVID') else 'non_COVID'
+
+
+def _covid3(c):
+    if c in SEVERE:
+        return 'COVID_moderate_or_severe'
+    return _covid2(c)
+
+
+def _class7(c):
+    return 'COVID_moderate_or_severe' if c in SEVERE else c
+
+
+SCHEMES = {}
+
+
+def register_scheme(scheme):
+    SCHEMES[scheme.name] = scheme
+    return scheme
+
+
+register_scheme(LabelScheme('covid2', _covid2, ('non_COVID', 'COVID')))
+register_scheme(LabelScheme('covid3', _covid3, ('non_COVID', 'COVID', 'COVID_moderate_or_severe')))
+register_scheme(LabelScheme('class7', _class7))
+register_scheme(LabelScheme('class', str))
+
+
+def get_scheme(name):
+    try:
+        return SCHEMES[name]
+    except KeyError:
+        raise KeyError('unknown label scheme %r (known: %s)' % (name, sorted(SCHEMES))) from None
+
+
+def encode(y_all, scheme):
+    """Encode CLASS values with a registered scheme name or a `LabelScheme`."""
+    if isinstance(scheme, str):
+        scheme = get_scheme(scheme)
+    return scheme.encode(y_all)
@@ -0,0 +1,132 @@
+"""Calibrated split of cores between parallel folds and xgboost threads.
+
+`calibrate` times short CV runs under several (fold_workers x nthread)
+layouts and records the fastest one for this host, data shape and round
+scale in ``~/.cache/cov19ml/layouts.json``.  ``engine.run(...,
+budget='auto')`` looks the layout up there, calibrating on first use.
+
+Worker start-up (spawning interpreters, importing xgboost, attaching the
+bundle) is paid once per pool, so it is excluded: each pool is warmed up
+until every worker has answered, and then every fold is run once before
+timing.  Two probe round counts give a fixed per-fold cost plus a per-round
+cost, from which the time of the real `num_round` is predicted.
+"""
+
+import json
+import math
+import os
+import socket
+import time
+
+from .cv import CoreBudget, _train_fold
+
+LAYOUT_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'cov19ml', 'layouts.json')
+
+
+def round_scale(num_round):
+    """Power-of-two bucket of `num_round`; layouts are calibrated per bucket."""
+    return 2 ** max(0, math.ceil(math.log2(max(1, num_round))))
+
+
+def layout_key(engine, n_cores, num_round=100):
+    n_data, n_features = engine.shape
+    method = 'float' if engine.max_bin is None else 'bins%d' % engine.max_bin
+    return '%s/%dcores/%dx%d/%dclass/%s/r%d' % (socket.gethostname(), n_cores, n_data, n_features,
+                                                engine.n_class, method, round_scale(num_round))
+
+
+def candidate_layouts(n_cores, n_fold):
+    """Worker counts 1, 2, 4, ... up to min(n_fold, n_cores), each with the leftover cores as nthread."""
+    top = max(1, min(n_fold, n_cores))
+    workers = [1]
+    while workers[-1] * 2 <= top:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != top:
+        workers.append(top)
+    return [CoreBudget(n_cores, w, max(1, n_cores // w)) for w in workers]
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save(path, table):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp%d' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _worker_pid(delay):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _probe(run, rounds):
+    # seconds of a full CV run at each round count, after one untimed pass
+    run(1)
+    out = []
+    for r in rounds:
+        t = time.perf_counter()
+        run(r)
+        out.append(time.perf_counter() - t)
+    return out
+
+
+def time_layout(engine, param, budget, rounds=(4, 16)):
+    """Seconds of a full CV run at each of `rounds` under `budget`, start-up excluded."""
+    budget = budget.resolve(engine.n_fold)
+    if budget.fold_workers == 1:
+        def run(r):
+            for i in range(engine.n_fold):
+                engine.train_fold(i, param, r, budget.nthread)
+        return _probe(run, rounds)
+    with engine.pool(budget.fold_workers) as ex:
+        pids = set()
+        while len(pids) < budget.fold_workers:
+            pids |= {job.result() for job in [ex.submit(_worker_pid, 0.05)
+                                              for _ in range(budget.fold_workers)]}
+
+        def run(r):
+            for job in [ex.submit(_train_fold, i, param, r, budget.nthread) for i in range(engine.n_fold)]:
+                job.result()
+        return _probe(run, rounds)
+
+
+def predicted_seconds(rounds, seconds, num_round):
+    """Fixed + per-round cost fitted through two probes, evaluated at `num_round`."""
+    (r0, r1), (t0, t1) = rounds, seconds
+    per_round = max(0.0, (t1 - t0) / (r1 - r0))
+    return max(0.0, t0 - per_round * r0) + per_round * num_round
+
+
+def calibrate(engine, param, num_round=100, n_cores=None, layouts=None, path=LAYOUT_FILE,
+              rounds=(4, 16)):
+    """Predict the `num_round`-round CV time per layout; persist and return the fastest `CoreBudget`."""
+    n_cores = n_cores or os.cpu_count()
+    layouts = layouts or candidate_layouts(n_cores, engine.n_fold)
+    timings = []
+    for budget in layouts:
+        probes = time_layout(engine, param, budget, rounds)
+        timings.append((predicted_seconds(rounds, probes, num_round), budget, probes))
+    seconds, best, _ = min(timings, key=lambda t: t[0])
+    table = _load(path)
+    table[layout_key(engine, n_cores, num_round)] = {
+        'fold_workers': best.fold_workers, 'nthread': best.nthread, 'seconds': seconds,
+        'num_round': num_round, 'rounds': list(rounds),
+        'timings': [[b.fold_workers, b.nthread, s, p] for s, b, p in timings]}
+    _save(path, table)
+    return best
+
+
+def tuned_budget(engine, param, num_round=100, n_cores=None, path=LAYOUT_FILE):
+    """Stored layout for this host, data shape and round scale, calibrating first if there is none."""
+    n_cores = n_cores or os.cpu_count()
+    entry = _load(path).get(layout_key(engine, n_cores, num_round))
+    if entry is None:
+        return calibrate(engine, param, num_round, n_cores=n_cores, path=path)
+    return CoreBudget(n_cores, entry['fold_workers'], entry['nthread'])
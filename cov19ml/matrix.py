@@ -0,0 +1,123 @@
+"""Read-only float32 memory-mapped copy of the cohort matrix.
+
+``X.to_numpy()`` gives every process its own float64 copy of the antigen
+matrix.  `materialize` writes the matrix once as ``X.npy`` (float32) next to
+sidecar arrays for the labels and feature names; `attach` maps the bundle
+read-only, so any number of CV workers share the same pages.  The ``sex`` /
+``age`` metadata columns (used as features by the ``*_sexage`` variants) are
+kept as a separate (n_data, 2) ``covariates.npy``.
+
+    matrix = attach(materialize(cohort))
+    X_np, y_covid = matrix.X, matrix.y_covid
+"""
+
+import os
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+SIDECARS = ['y_covid', 'y_all', 'ids', 'feature_names']
+COVARIATES = ('sex', 'age')
+
+
+def covariate_matrix(meta):
+    """(n_data, 2) float32 sex / age, sex coded as in the scripts (F = 1, M = 0)."""
+    sex = meta['sex'].map({'F': 1, 'M': 0}) if 'sex' in meta else pd.Series(np.nan, index=meta.index)
+    age = meta['age'] if 'age' in meta else pd.Series(np.nan, index=meta.index)
+    return np.column_stack([pd.to_numeric(sex, errors='coerce'),
+                            pd.to_numeric(age, errors='coerce')]).astype(np.float32)
+
+
+@dataclass
+class CohortMatrix:
+    """Memory-mapped cohort: `X` is (n_data, n_features) float32, read-only."""
+    X: np.ndarray
+    y_covid: np.ndarray
+    y_all: np.ndarray
+    ids: np.ndarray
+    feature_names: np.ndarray
+    path: str
+    covariates: np.ndarray = None  # (n_data, 2) float32, columns COVARIATES
+
+    @property
+    def key(self):
+        return os.path.basename(self.path).split('_', 1)[1]
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    def labels(self, scheme):
+        """Integer targets and class names for a label scheme.
+
+        Stored as ``labels_<scheme>.npy`` / ``classes_<scheme>.npy`` in the
+        bundle, so the encoding is done once per data drop.
+        """
+        from .labels import encode
+        name = scheme if isinstance(scheme, str) else scheme.name
+        y_path = os.path.join(self.path, 'labels_' + name + '.npy')
+        classes_path = os.path.join(self.path, 'classes_' + name + '.npy')
+        if not os.path.exists(classes_path):
+            y, classes = encode(self.y_all, scheme)
+            for p, arr in [(y_path, y), (classes_path, np.array(classes))]:
+                tmp = p + '.tmp%d.npy' % os.getpid()
+                np.save(tmp, arr)
+                os.replace(tmp, p)
+        return np.load(y_path, mmap_mode='r'), np.load(classes_path).tolist()
+
+
+def matrix_path(cohort, cache_dir):
+    return os.path.join(cache_dir, 'matrix_' + cohort.key)
+
+
+def materialize(cohort, cache_dir=None):
+    """Write the bundle for `cohort` under `cache_dir` unless it already exists.
+
+    `cache_dir` defaults to the directory `load_cohort` used for the Parquet
+    cache.  Returns the bundle path, which is all a worker needs to `attach`.
+    """
+    if cache_dir is None:
+        cache_dir = cohort.cache_dir
+    if cache_dir is None:
+        raise ValueError('cache_dir is required for a cohort loaded without cache')
+    path = matrix_path(cohort, cache_dir)
+    if os.path.exists(path):
+        if not os.path.exists(os.path.join(path, 'covariates.npy')):
+            # bundles written before covariates were stored
+            tmp = os.path.join(path, 'covariates.tmp%d.npy' % os.getpid())
+            np.save(tmp, covariate_matrix(cohort.meta))
+            os.replace(tmp, os.path.join(path, 'covariates.npy'))
+        return path
+    tmp = path + '.tmp%d' % os.getpid()
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        X = np.lib.format.open_memmap(os.path.join(tmp, 'X.npy'), mode='w+',
+                                      dtype=np.float32, shape=cohort.shape)
+        X[:] = cohort.X.to_numpy(dtype=np.float32)
+        X.flush()
+        del X
+        np.save(os.path.join(tmp, 'y_covid.npy'), cohort.y_covid.astype(np.int8))
+        # fixed-width unicode so the sidecars load without pickle and can be mapped too
+        np.save(os.path.join(tmp, 'y_all.npy'), cohort.y_all.astype(str))
+        np.save(os.path.join(tmp, 'ids.npy'), cohort.ids.astype(str))
+        np.save(os.path.join(tmp, 'feature_names.npy'), cohort.feature_names.astype(str))
+        np.save(os.path.join(tmp, 'covariates.npy'), covariate_matrix(cohort.meta))
+        os.replace(tmp, path)
+    except OSError:
+        # another process finished the same bundle first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(path):
+            raise
+    return path
+
+
+def attach(path):
+    """Map a bundle written by `materialize` without copying it."""
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+              for name in ['X'] + SIDECARS}
+    cov_path = os.path.join(path, 'covariates.npy')
+    if os.path.exists(cov_path):
+        arrays['covariates'] = np.load(cov_path, mmap_mode='r')
+    return CohortMatrix(path=path, **arrays)
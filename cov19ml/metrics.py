@@ -0,0 +1,132 @@
+"""NumPy metric kernels for stacks of folds, seeds or thresholds.
+
+Each fold of the scripts binarizes with a list comprehension and then calls
+accuracy_score, precision_score, recall_score, f1_score, matthews_corrcoef
+and confusion_matrix one by one, every call re-validating the labels.  Here
+the confusion matrix is counted once with a single ``bincount`` and every
+metric is derived from it.  All functions accept leading batch dimensions:
+``y_pred`` of shape (..., n_data) gives confusion matrices of shape
+(..., n_class, n_class) and metrics of shape (...).
+
+Conventions follow sklearn: rows are true labels, columns predictions;
+binary precision / recall / F1 are for class 1, multiclass ones are macro
+averages over the classes that occur; undefined ratios (0 / 0) are 0.
+"""
+
+import numpy as np
+
+THRESHOLD_METRICS = ['accuracy', 'recall', 'precision', 'f1_score', 'mcc']
+
+
+def confusion(y_true, y_pred, n_class):
+    """Confusion counts; `y_true` broadcasts against a stack of `y_pred`."""
+    y_pred = np.asarray(y_pred)
+    y_true = np.broadcast_to(np.asarray(y_true), y_pred.shape)
+    batch = y_pred.shape[:-1]
+    n_batch = int(np.prod(batch))
+    flat = (np.arange(n_batch)[:, None] * (n_class * n_class)
+            + y_true.reshape(n_batch, -1) * n_class + y_pred.reshape(n_batch, -1))
+    counts = np.bincount(flat.ravel(), minlength=n_batch * n_class * n_class)
+    return counts.reshape(batch + (n_class, n_class))
+
+
+def _ratio(num, den):
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), np.asarray(den, dtype=float))
+    out = np.zeros(num.shape)
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+
+def mcc_from_confusion(cm):
+    """Matthews correlation (multiclass R_K statistic; equals the usual MCC for two classes)."""
+    cm = np.asarray(cm, dtype=float)
+    t = cm.sum(axis=-1)
+    p = cm.sum(axis=-2)
+    c = np.trace(cm, axis1=-2, axis2=-1)
+    s = cm.sum(axis=(-2, -1))
+    cov = c * s - (t * p).sum(axis=-1)
+    den = np.sqrt((s * s - (p * p).sum(axis=-1)) * (s * s - (t * t).sum(axis=-1)))
+    return _ratio(cov, den)
+
+
+def confusion_metrics(cm):
+    """accuracy / recall / precision / f1_score / mcc from confusion matrices."""
+    cm = np.asarray(cm)
+    n_class = cm.shape[-1]
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)
+    recall = _ratio(tp, cm.sum(axis=-1))
+    precision = _ratio(tp, cm.sum(axis=-2))
+    f1 = _ratio(2 * tp, cm.sum(axis=-1) + cm.sum(axis=-2))
+    if n_class == 2:
+        recall, precision, f1 = recall[..., 1], precision[..., 1], f1[..., 1]
+    else:
+        # like sklearn, macro averages skip classes absent from both labels and predictions
+        present = (cm.sum(axis=-1) + cm.sum(axis=-2)) > 0
+        n_present = present.sum(axis=-1)
+        recall, precision, f1 = (_ratio((v * present).sum(axis=-1), n_present)
+                                 for v in (recall, precision, f1))
+    return {'accuracy': _ratio(tp.sum(axis=-1), cm.sum(axis=(-2, -1))),
+            'recall': recall, 'precision': precision, 'f1_score': f1,
+            'mcc': mcc_from_confusion(cm)}
+
+
+def predict_labels(prob, n_class, threshold=0.5):
+    """Class predictions: ``prob >= threshold`` for binary scores (..., n_data),
+    argmax for multiclass probabilities (..., n_data, n_class)."""
+    prob = np.asarray(prob)
+    if n_class == 2:
+        return (prob >= threshold).astype(np.intp)
+    return prob.argmax(axis=-1)
+
+
+def threshold_metrics(y_true, prob, n_class, threshold=0.5):
+    """(confusion, metrics) for a (stack of) probability predictions."""
+    cm = confusion(y_true, predict_labels(prob, n_class, threshold), n_class)
+    return cm, confusion_metrics(cm)
+
+
+def midranks(sorted_scores):
+    """1-based ranks of already sorted rows, ties sharing their average rank."""
+    n = sorted_scores.shape[-1]
+    pos = np.broadcast_to(np.arange(n), sorted_scores.shape)
+    new = np.ones(sorted_scores.shape, dtype=bool)
+    new[..., 1:] = sorted_scores[..., 1:] != sorted_scores[..., :-1]
+    last = np.ones(sorted_scores.shape, dtype=bool)
+    last[..., :-1] = new[..., 1:]
+    start = np.maximum.accumulate(np.where(new, pos, 0), axis=-1)
+    end = np.flip(np.minimum.accumulate(np.flip(np.where(last, pos, n), axis=-1), axis=-1), axis=-1)
+    return (start + end) / 2 + 1
+
+
+def auc(y_true, score):
+    """Binary ROC AUC of every score row (..., n_data) via the rank-sum statistic.
+
+    Each row is sorted once; tied scores get midranks, which matches
+    sklearn's trapezoidal roc_auc_score.  Rows without both classes give NaN.
+    """
+    score = np.asarray(score)
+    y = np.broadcast_to(np.asarray(y_true) == 1, score.shape)
+    order = np.argsort(score, axis=-1, kind='stable')
+    ranks = midranks(np.take_along_axis(score, order, axis=-1))
+    y_sorted = np.take_along_axis(y, order, axis=-1)
+    n_pos = y.sum(axis=-1)
+    n_neg = y.shape[-1] - n_pos
+    rank_sum = (ranks * y_sorted).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (rank_sum - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def ovr_auc(y_true, prob, n_class):
+    """Macro one-vs-rest AUC for probabilities (..., n_data, n_class); one sort per class column."""
+    prob = np.asarray(prob)
+    y = np.asarray(y_true)
+    onehot = y[..., None] == np.arange(n_class)
+    per_class = auc(np.moveaxis(onehot, -1, -2), np.moveaxis(prob, -1, -2))
+    return per_class.mean(axis=-1)
+
+
+def score_auc(y_true, prob, n_class):
+    """Binary AUC or macro OvR AUC, whichever `n_class` calls for."""
+    if n_class == 2:
+        return auc(y_true, prob)
+    return ovr_auc(y_true, prob, n_class)
@@ -0,0 +1,320 @@
+"""Exhaustive search for small antigen panels (ExtTab4).
+
+The ExtTab4 scripts fit ``LogisticRegression(random_state=0)`` on
+hand-picked panels such as ["BCORP1", "KAT2A"] under the usual
+StratifiedKFold split.  `panel_search` scores every single antigen and
+every pair the same way, then triples grown from the best pairs.
+
+Panels are fitted in batches: the training rows of B panels form one
+(B, n_tr, size + 1) array and all B L2-penalised logistic regressions take
+their Newton steps together (`fit_logistic`), matching sklearn's lbfgs
+solution to its tolerance.  Batches go to the engine's process pool when a
+`CoreBudget` is given: up to one worker per batch of pairs, and the cores
+left over as each worker's BLAS threads.
+
+Triples are generated from their best-scoring sub-pair only, walking the
+pairs from best to worst.  The walk stops once a pair's score plus a slack
+falls below the `keep`-th best triple found so far.  This is a heuristic,
+not a bound: CV scores give no limit on what one more antigen can add.  The
+slack is the largest gain of a scored triple over its best sub-pair seen so
+far (raised to `slack` if given), and `PanelSearch.triples_complete` says
+whether the walk was cut short, i.e. whether triple results may be missing.
+
+`forward_selection` instead grows one panel greedily: each step scores
+every remaining antigen as an addition on all folds at once and keeps the
+best, until the target metric is reached.  `panel_scores` hands back the
+per-fold fits of every candidate, and each step warm-starts its candidates
+from the fits of the antigen the previous step chose (new coefficient 0), so
+they take a few Newton steps and the current panel is never refitted.
+
+    search = panel_search(CVEngine(cohort.shared_matrix()), budget=CoreBudget())
+    search.table(2).head(10)
+"""
+
+from dataclasses import dataclass, field
+from math import ceil, comb
+
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+from threadpoolctl import threadpool_limits
+
+from .bootstrap import metric_stack
+from .cv import METRICS
+from .results import SPLITS
+
+
+def _loss(A, y, theta, pen):
+    z = (A @ theta[..., None])[..., 0]
+    return (np.logaddexp(0, z) - y * z).sum(axis=1) + 0.5 * (pen * theta ** 2).sum(axis=1)
+
+
+def fit_logistic(X, y, C=1.0, max_iter=100, tol=1e-6, coef0=None, intercept0=None):
+    """Batched ``LogisticRegression(C=C)``: X (B, n, d), y (n,) -> (coef (B, d), intercept (B,)).
+
+    Minimises the summed log-loss plus ``||coef||^2 / (2 C)`` (intercept not
+    penalised) by damped Newton steps on standardised columns, which leaves
+    the solution in the original units unchanged.  `coef0` / `intercept0`
+    (broadcast to (B, d) / (B,)) warm-start the steps, e.g. from a fit on
+    fewer columns with zeros for the new ones.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    B, n, d = X.shape
+    mu = X.mean(axis=1, keepdims=True)
+    sd = X.std(axis=1, keepdims=True)
+    sd[sd == 0] = 1
+    A = np.concatenate([(X - mu) / sd, np.ones((B, n, 1))], axis=2)
+    # the penalty on a raw coefficient w is (w_std / sd)^2
+    pen = np.concatenate([1 / (C * sd[:, 0] ** 2), np.zeros((B, 1))], axis=1)
+    theta = np.zeros((B, d + 1))
+    if coef0 is not None:
+        coef0 = np.broadcast_to(coef0, (B, d))
+        theta[:, :d] = coef0 * sd[:, 0]
+        theta[:, d] = np.broadcast_to(intercept0, (B,)) + (coef0 * mu[:, 0]).sum(axis=1)
+    loss = _loss(A, y, theta, pen)
+    # models that have converged drop out of the batch
+    active = np.arange(B)
+    for _ in range(max_iter):
+        Aa, th, pa = A[active], theta[active], pen[active]
+        At = Aa.transpose(0, 2, 1)
+        p = expit((Aa @ th[..., None])[..., 0])
+        g = (At @ (p - y)[..., None])[..., 0] + pa * th
+        H = (At * (p * (1 - p))[:, None]) @ Aa
+        H[:, np.arange(d + 1), np.arange(d + 1)] += pa
+        step = np.linalg.solve(H, g[..., None])[..., 0]
+        old = loss[active]
+        new = _loss(Aa, y, th - step, pa)
+        t = np.ones(len(active))
+        # step halving where the full Newton step overshoots
+        for _ in range(30):
+            worse = np.flatnonzero(new > old + 1e-12 * np.abs(old))
+            if not len(worse):
+                break
+            t[worse] /= 2
+            new[worse] = _loss(Aa[worse], y, th[worse] - t[worse, None] * step[worse], pa[worse])
+        theta[active] = th - t[:, None] * step
+        loss[active] = np.minimum(new, old)
+        active = active[np.abs(t[:, None] * step).max(axis=1) >= tol]
+        if not len(active):
+            break
+    coef = theta[:, :d] / sd[:, 0]
+    intercept = theta[:, d] - (coef * mu[:, 0]).sum(axis=1)
+    return coef, intercept
+
+
+def predict_logistic(X, coef, intercept):
+    """P(y = 1) for X (B, n, d) under B fitted models."""
+    return expit((np.asarray(X, dtype=np.float64) @ coef[..., None])[..., 0] + intercept[:, None])
+
+
+def panel_scores(engine, panels, C=1.0, init=None, fits=False):
+    """(B, 2, n_metric) train / test metrics of `panels` (B, size), averaged over the engine's folds.
+
+    `init` is an optional per-fold warm start (coef (n_fold, size), intercept (n_fold,)).
+    With `fits`, also returns the per-fold fits, coef (B, n_fold, size) and
+    intercept (B, n_fold), to warm-start larger panels from.
+    """
+    panels = np.asarray(panels)
+    X = np.asarray(engine.X)
+    Xp = np.moveaxis(X[:, panels], 0, 1)
+    out = np.zeros((len(panels), len(SPLITS), len(METRICS)))
+    coefs, intercepts = [], []
+    for f, (tr, te) in enumerate(engine.folds):
+        start = {} if init is None else {'coef0': init[0][f], 'intercept0': init[1][f]}
+        coef, intercept = fit_logistic(Xp[:, tr], engine.y[tr], C, **start)
+        coefs.append(coef)
+        intercepts.append(intercept)
+        for s, idx in enumerate((tr, te)):
+            m = metric_stack(engine.y[idx], predict_logistic(Xp[:, idx], coef, intercept), 2)
+            out[:, s] += np.stack([m[k] for k in METRICS], axis=1)
+    out /= engine.n_fold
+    if not fits:
+        return out
+    return out, np.stack(coefs, axis=1), np.stack(intercepts, axis=1)
+
+
+def _score_job(panels, C, init=None, fits=False, nthread=None):
+    from . import cv
+    # the Newton solves are BLAS calls: keep each worker to its share of the cores
+    with threadpool_limits(nthread, user_api='blas'):
+        return panel_scores(cv._ENGINE, panels, C, init, fits)
+
+
+def _pool(engine, n_panels, batch, budget):
+    # one job per batch of panels, so size the pool by batches, not folds
+    budget = budget.resolve(max(1, ceil(n_panels / batch)))
+    return engine.pool(budget.fold_workers), budget.nthread
+
+
+def _score(engine, panels, C, batch, ex=None, init=None, fits=False, nthread=None):
+    chunks = [panels[k:k + batch] for k in range(0, len(panels), batch)]
+    if not chunks:
+        out = np.empty((0, len(SPLITS), len(METRICS)))
+        return out if not fits else (out, np.empty((0, engine.n_fold, panels.shape[1])),
+                                     np.empty((0, engine.n_fold)))
+    if ex is None:
+        parts = [panel_scores(engine, p, C, init, fits) for p in chunks]
+    else:
+        parts = [job.result() for job in [ex.submit(_score_job, p, C, init, fits, nthread)
+                                          for p in chunks]]
+    if not fits:
+        return np.concatenate(parts)
+    return tuple(np.concatenate(a) for a in zip(*parts))
+
+
+def _triples_from(pairs, ranks, rank_of):
+    # triples whose best-ranked sub-pair is one of `pairs`, and the row of that pair
+    a, b = pairs[:, 0], pairs[:, 1]
+    r = ranks[:, None]
+    c = np.nonzero((rank_of[a] > r) & (rank_of[b] > r))
+    triples = np.column_stack([a[c[0]], b[c[0]], c[1]])
+    return np.sort(triples, axis=1), c[0]
+
+
+@dataclass
+class PanelSearch:
+    """Scores of the evaluated panels: ``panels[size]`` (m, size) feature indices,
+    ``scores[size]`` (m, 2, n_metric) fold-mean train / test metrics."""
+    feature_names: np.ndarray
+    panels: dict
+    scores: dict
+    n_candidates: dict = field(default_factory=dict)
+    metric_names: tuple = tuple(METRICS)
+    triples_complete: bool = True  # False: the triple walk stopped early (heuristic pruning)
+    slack: float = None  # slack in force when the walk stopped
+
+    def table(self, size, metric='auc', split='test', top=None):
+        """Panels of one size, best first, with ``train_<metric>`` / ``test_<metric>`` columns."""
+        flat = self.scores[size].reshape(len(self.panels[size]), -1)
+        table = pd.DataFrame(flat, columns=[s + '_' + m for s in SPLITS for m in self.metric_names])
+        table.insert(0, 'panel', [tuple(str(f) for f in self.feature_names[p]) for p in self.panels[size]])
+        table = table.sort_values(by=split + '_' + metric, ascending=False, kind='stable')
+        return table.reset_index(drop=True) if top is None else table.head(top).reset_index(drop=True)
+
+    def pruned(self, size):
+        """Fraction of the possible panels of `size` that were never fitted."""
+        return 1 - len(self.panels[size]) / self.n_candidates[size]
+
+
+def panel_search(engine, metric='auc', C=1.0, triples=True, keep=100, slack=None,
+                 batch=2048, pair_chunk=256, budget=None):
+    """Score all 1- and 2-antigen panels and the pruned 3-antigen panels.
+
+    Panels are ranked by their fold-mean test `metric`.  Triples are grown
+    `pair_chunk` pairs at a time from the best pairs until the stopping
+    rule of the module docstring (a heuristic) ends the walk; the result
+    records whether it did.  ``slack=np.inf`` scores every triple.
+    """
+    if engine.n_class != 2:
+        raise ValueError('panel search fits binary logistic regressions; use a 2-class scheme')
+    n = len(engine.feature_names)
+    m = METRICS.index(metric)
+    test = SPLITS.index('test')
+    panels, scores = {}, {}
+    complete, gain = True, None
+    ex, nthread = None, None
+    if budget is not None:
+        ex, nthread = _pool(engine, comb(n, 2), batch, budget)
+    try:
+        panels[1] = np.arange(n)[:, None]
+        panels[2] = np.column_stack(np.triu_indices(n, 1)).astype(np.intp)
+        for size in (1, 2):
+            scores[size] = _score(engine, panels[size], C, batch, ex, nthread=nthread)
+        if triples and n >= 3:
+            key = scores[2][:, test, m]
+            order = np.argsort(-key, kind='stable')
+            rank_of = np.full((n, n), -1, dtype=np.intp)
+            rank_of[panels[2][order, 0], panels[2][order, 1]] = np.arange(len(order))
+            rank_of[panels[2][order, 1], panels[2][order, 0]] = np.arange(len(order))
+            found, found_scores = [], []
+            best = np.empty(0)
+            gain = 0.0 if slack is None else slack
+            for start in range(0, len(order), pair_chunk):
+                ranks = np.arange(start, min(start + pair_chunk, len(order)))
+                if len(best) >= keep and key[order[start]] + gain < best[keep - 1]:
+                    complete = False
+                    break
+                cand, parent = _triples_from(panels[2][order[ranks]], ranks, rank_of)
+                s = _score(engine, cand, C, batch, ex, nthread=nthread)
+                found.append(cand)
+                found_scores.append(s)
+                best = np.sort(np.concatenate([best, s[:, test, m]]))[::-1][:keep]
+                if len(cand):
+                    gain = max(gain, float(np.nanmax(s[:, test, m] - key[order[ranks[parent]]])))
+            panels[3] = np.concatenate(found) if found else np.empty((0, 3), dtype=np.intp)
+            scores[3] = np.concatenate(found_scores) if found_scores else \
+                np.empty((0, len(SPLITS), len(METRICS)))
+    finally:
+        if ex is not None:
+            ex.shutdown()
+    return PanelSearch(engine.feature_names, panels, scores, {k: comb(n, k) for k in panels},
+                       triples_complete=complete, slack=gain)
+
+
+@dataclass
+class ForwardPath:
+    """Greedy panel growth: ``panel`` in the order antigens were added and
+    ``scores`` (n_step, 2, n_metric) fold-mean metrics of each prefix."""
+    feature_names: np.ndarray
+    panel: list
+    scores: np.ndarray
+    reached: bool
+    metric_names: tuple = tuple(METRICS)
+
+    @property
+    def selected(self):
+        return [str(f) for f in self.feature_names[self.panel]]
+
+    def steps(self):
+        """One row per step: the antigen added and the metrics of the panel so far."""
+        flat = self.scores.reshape(len(self.panel), -1)
+        table = pd.DataFrame(flat, columns=[s + '_' + m for s in SPLITS for m in self.metric_names],
+                             index=pd.Index(np.arange(1, len(self.panel) + 1), name='n_features'))
+        table.insert(0, 'added', self.selected)
+        return table
+
+
+def forward_selection(engine, metric='mcc', target=None, max_features=10, C=1.0, start=(),
+                      batch=2048, budget=None):
+    """Smallest greedy panel whose fold-mean test `metric` reaches `target`.
+
+    Starts from the antigen names in `start` and adds one antigen per step
+    until `target` is reached (never, if None) or the panel has
+    `max_features` antigens.
+    """
+    if engine.n_class != 2:
+        raise ValueError('forward selection fits binary logistic regressions; use a 2-class scheme')
+    names = [str(f) for f in engine.feature_names]
+    n = len(names)
+    m = METRICS.index(metric)
+    test = SPLITS.index('test')
+    panel = [names.index(f) for f in start]
+    scores, init = [], None
+    if panel:
+        s, coef, intercept = panel_scores(engine, [panel], C, fits=True)
+        scores.append(s[0])
+        init = coef[0], intercept[0]
+    reached = bool(scores) and target is not None and scores[-1][test, m] >= target
+    ex, nthread = None, None
+    if budget is not None:
+        # the first step has the most candidates
+        ex, nthread = _pool(engine, n - len(panel), batch, budget)
+    try:
+        while not reached and len(panel) < min(max_features, n):
+            rest = np.setdiff1d(np.arange(n), panel)
+            cand = np.column_stack([np.tile(panel, (len(rest), 1)), rest]).astype(np.intp)
+            if init is not None:
+                # the new antigen's coefficient starts at 0
+                init = np.column_stack([init[0], np.zeros(engine.n_fold)]), init[1]
+            s, coef, intercept = _score(engine, cand, C, batch, ex, init, fits=True, nthread=nthread)
+            best = int(np.argmax(s[:, test, m]))
+            panel.append(int(rest[best]))
+            scores.append(s[best])
+            init = coef[best], intercept[best]
+            reached = target is not None and s[best, test, m] >= target
+    finally:
+        if ex is not None:
+            ex.shutdown()
+    return ForwardPath(engine.feature_names, panel,
+                       np.array(scores).reshape(len(panel), len(SPLITS), len(METRICS)), reached)
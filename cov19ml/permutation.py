@@ -0,0 +1,162 @@
+"""Label-permutation test for cross-validated performance.
+
+Each permutation shuffles the targets (with a generator seeded by
+(seed, permutation), so a permutation is reproducible) and reruns the full
+k-fold CV on the engine's fixed folds.  Permutations are dispatched in
+batches to the engine's process pool, whose workers attach to the shared
+(optionally binned) cohort matrix.  Every finished permutation is appended
+to a JSON-lines file as soon as it arrives, so an interrupted run resumes
+where it stopped.  The file starts with a header record of the setup (data
+key, scheme, folds, seed, num_round, parameters); resuming with a different
+setup is refused rather than mixing two null distributions.
+
+    result = permutation_test(engine, binary_param, 40, n_perm=500,
+                              path='perm_2class.jsonl', budget=CoreBudget())
+    result.p_value('auc')
+"""
+
+import json
+import math
+import os
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .cv import METRICS
+
+
+def permuted_labels(y, seed, perm):
+    return np.random.default_rng([seed, perm]).permutation(y)
+
+
+def cv_scores(engine, param, num_round, y=None, nthread=None):
+    """Mean test-fold metrics of one full CV run.
+
+    Shuffled labels can leave a test fold without one of the classes; its
+    undefined AUC is skipped in the mean.
+    """
+    rows = [engine.train_fold(i, param, num_round, nthread, y=y).metrics for i in range(engine.n_fold)]
+    return {m: float(np.nanmean([r['test_' + m] for r in rows])) for m in METRICS}
+
+
+def _perm_batch(perms, param, num_round, nthread, seed):
+    from . import cv
+    engine = cv._ENGINE
+    return [(p, cv_scores(engine, param, num_round, permuted_labels(engine.y, seed, p), nthread))
+            for p in perms]
+
+
+def run_header(engine, param, num_round, seed):
+    """Setup record identifying which null distribution a file holds."""
+    p = engine.param_for(param, engine.y[engine.folds[0][0]])
+    p.pop('nthread', None)
+    return {'header': 1, 'key': engine.key, 'scheme': str(engine.scheme), 'n_fold': engine.n_fold,
+            'fold_seed': engine.seed, 'seed': seed, 'num_round': num_round,
+            'param': json.loads(json.dumps(p, sort_keys=True, default=str))}
+
+
+def read_null(path):
+    """Permutations already stored in `path`, as {perm: scores} (the header is skipped)."""
+    return _read(path)[1]
+
+
+def _read(path):
+    header, done = None, {}
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by an interruption; that permutation is rerun
+                    continue
+                if 'header' in rec:
+                    header = rec
+                else:
+                    done[rec.pop('perm')] = rec
+    return header, done
+
+
+def _truncate_partial(path):
+    # drop an unterminated last line so the next record starts on its own line
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = pos = f.tell()
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            k = f.read(step).rfind(b'\n')
+            if k >= 0:
+                pos = pos - step + k + 1
+                break
+            pos -= step
+        if pos != size:
+            f.truncate(pos)
+
+
+@dataclass
+class PermutationResult:
+    observed: dict
+    null: pd.DataFrame
+
+    def p_value(self, metric='auc'):
+        """(1 + #null >= observed) / (1 + n_perm)."""
+        null = self.null[metric].to_numpy()
+        return (1 + np.sum(null >= self.observed[metric])) / (1 + len(null))
+
+
+def permutation_test(engine, param, num_round, n_perm=200, path=None, budget=None,
+                     seed=0, batch=4):
+    """Null distribution of mean test-fold metrics under `n_perm` label shuffles.
+
+    With a `CoreBudget`, batches of `batch` permutations run on the engine's
+    process pool.  `path` (JSON lines) receives each permutation as it
+    finishes and is read back on restart; a file written with another setup
+    raises ValueError.
+    """
+    header = run_header(engine, param, num_round, seed)
+    stored, done = _read(path)
+    if (done or stored is not None) and stored != header:
+        raise ValueError('%s holds permutations of a different setup (%s); use another path'
+                         % (path, stored))
+    observed = cv_scores(engine, param, num_round)
+    todo = [p for p in range(n_perm) if p not in done]
+    out = None
+    if path is not None:
+        if os.path.exists(path):
+            _truncate_partial(path)
+        out = open(path, 'a')
+        if stored is None:
+            out.write(json.dumps(header) + '\n')
+            out.flush()
+
+    def record(p, scores):
+        done[p] = scores
+        if out is not None:
+            out.write(json.dumps(dict(perm=p, **scores)) + '\n')
+            out.flush()
+
+    try:
+        if budget is None:
+            for p in todo:
+                record(p, cv_scores(engine, param, num_round, permuted_labels(engine.y, seed, p)))
+        else:
+            # one job per batch: cores beyond the batch count go to xgboost threads
+            budget = budget.resolve(max(1, math.ceil(len(todo) / batch)))
+            with engine.pool(budget.fold_workers) as ex:
+                jobs = [ex.submit(_perm_batch, todo[k:k + batch], param, num_round, budget.nthread, seed)
+                        for k in range(0, len(todo), batch)]
+                for job in as_completed(jobs):
+                    for p, scores in job.result():
+                        record(p, scores)
+    finally:
+        if out is not None:
+            out.close()
+    null = pd.DataFrame.from_dict({p: done[p] for p in range(n_perm)}, orient='index')
+    null.index.name = 'perm'
+    return PermutationResult(observed, null)
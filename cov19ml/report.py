@@ -0,0 +1,37 @@
+"""The scripts' summary tables, built from CV engine outputs."""
+
+from dataclasses import dataclass
+
+import pandas as pd
+
+from .results import FoldResults
+from .rounds import cv_curves
+
+
+@dataclass
+class SinglePassResult:
+    cv_res: pd.DataFrame
+    best_round: int
+    results: FoldResults
+    outputs: list
+
+    @property
+    def metrics(self):
+        return self.results.summary()
+
+    @property
+    def importance(self):
+        return self.results.importance_stats()
+
+
+def single_pass(engine, param, num_round=100, budget=None, metric='test-auc-mean'):
+    """Round-selection curves, fold metric table and importances from one booster per fold.
+
+    Replaces the ``xgb.cv`` pre-pass plus the separate evaluation loop of
+    ExtTab3/xgboost_2class_allfeatures.py.  Both now use the engine's folds
+    (stratified on CLASS); the metric table is taken at `num_round` as in the
+    script, and `best_round` is the ``cv_res[metric].argmax()`` it printed.
+    """
+    outputs = list(engine.run(param, num_round, budget=budget, curves=True))
+    cv_res = cv_curves(outputs)
+    return SinglePassResult(cv_res, int(cv_res[metric].argmax()), engine.results(outputs), outputs)
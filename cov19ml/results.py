@@ -0,0 +1,131 @@
+"""Array-backed record of a CV run.
+
+Replaces the scripts' fourteen parallel lists (acc_list_all_tr, ...,
+table_list_all_te, imp_list) and the string-index renaming done before
+concatenating them.  A `FoldResults` holds
+
+- ``metrics``    (n_fold, 2, n_metric) float, split 0 = train, 1 = test
+- ``confusion``  (n_fold, 2, n_class, n_class) int, rows = true labels
+- ``importance`` (n_fold, n_feature) float, split counts per fold (a view
+  into ``importances``, which holds every xgboost importance type)
+
+and exports views of them to pandas or Parquet without per-fold frames.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .cv import METRICS
+from .importance import IMPORTANCE_TYPES, ImportanceStack
+
+SPLITS = ('train', 'test')
+
+
+@dataclass
+class FoldResults:
+    metrics: np.ndarray
+    confusion: np.ndarray
+    importances: ImportanceStack
+    metric_names: tuple = tuple(METRICS)
+
+    @classmethod
+    def from_outputs(cls, outputs, feature_names, n_class):
+        n_fold = len(outputs)
+        metrics = np.empty((n_fold, len(SPLITS), len(METRICS)))
+        confusion = np.empty((n_fold, len(SPLITS), n_class, n_class), dtype=np.int64)
+        for i, o in enumerate(outputs):
+            for s, split in enumerate(SPLITS):
+                metrics[i, s] = [o.metrics[split + '_' + m] for m in METRICS]
+                confusion[i, s] = o.confusion[split]
+        importances = ImportanceStack(np.stack([o.importance for o in outputs], axis=1),
+                                      np.asarray(feature_names))
+        return cls(metrics, confusion, importances)
+
+    @property
+    def n_fold(self):
+        return self.metrics.shape[0]
+
+    @property
+    def feature_names(self):
+        return self.importances.feature_names
+
+    @property
+    def importance(self):
+        return self.importances.get('weight')
+
+    def metric(self, name, split='test'):
+        """Per-fold values of one metric (a view)."""
+        return self.metrics[:, SPLITS.index(split), self.metric_names.index(name)]
+
+    def columns(self):
+        return [s + '_' + m for s in SPLITS for m in self.metric_names]
+
+    def to_frame(self):
+        """One row per fold, ``train_<metric>`` then ``test_<metric>`` columns (no copy)."""
+        return pd.DataFrame(self.metrics.reshape(self.n_fold, -1), columns=self.columns(), copy=False)
+
+    def summary(self):
+        """``df_all_metrics_with_stats``: fold rows plus mean and stddev (ddof=1) rows."""
+        flat = self.metrics.reshape(self.n_fold, -1)
+        table = np.vstack([flat, flat.mean(axis=0), flat.std(axis=0, ddof=1)])
+        index = [str(i) for i in range(self.n_fold)] + ['mean', 'stddev']
+        return pd.DataFrame(table, index=index, columns=self.columns())
+
+    def confusion_frame(self, split='test'):
+        """Confusion counts as rows (fold, label) x columns pred<k>."""
+        c = self.confusion[:, SPLITS.index(split)]
+        n_class = c.shape[-1]
+        index = pd.MultiIndex.from_product([range(self.n_fold), ['label%d' % k for k in range(n_class)]],
+                                           names=['fold', 'label'])
+        return pd.DataFrame(c.reshape(-1, n_class), index=index,
+                            columns=['pred%d' % k for k in range(n_class)], copy=False)
+
+    def importance_frame(self, importance_type='weight'):
+        """Feature x fold importances (the scripts' ``pd.concat(imp_list, axis=1)``)."""
+        return self.importances.frame(importance_type)
+
+    def importance_stats(self, importance_type='weight'):
+        """``tmp_imp_stat``: mean / std over folds, sorted by mean."""
+        return self.importances.ranking(importance_type)
+
+    def to_parquet(self, path):
+        """Write metrics.parquet, confusion.parquet and importance_<type>.parquet under `path`."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        os.makedirs(path, exist_ok=True)
+        fold = pa.array(np.arange(self.n_fold, dtype=np.int32))
+        flat = self.metrics.reshape(self.n_fold, -1)
+        pq.write_table(pa.table([fold] + [pa.array(flat[:, j]) for j in range(flat.shape[1])],
+                                names=['fold'] + self.columns()),
+                       os.path.join(path, 'metrics.parquet'))
+        n_class = self.confusion.shape[-1]
+        c = self.confusion.reshape(self.n_fold, len(SPLITS), n_class * n_class)
+        pq.write_table(pa.table([fold] + [pa.array(c[:, s, k]) for s in range(len(SPLITS))
+                                          for k in range(n_class * n_class)],
+                                names=['fold'] + ['%s_label%d_pred%d' % (split, k // n_class, k % n_class)
+                                                  for split in SPLITS for k in range(n_class * n_class)]),
+                       os.path.join(path, 'confusion.parquet'))
+        for t in self.importances.types:
+            v = self.importances.get(t)
+            pq.write_table(pa.table([fold] + [pa.array(v[:, j]) for j in range(v.shape[1])],
+                                    names=['fold'] + [str(f) for f in self.feature_names]),
+                           os.path.join(path, 'importance_%s.parquet' % t))
+
+    @classmethod
+    def read_parquet(cls, path):
+        metrics = pd.read_parquet(os.path.join(path, 'metrics.parquet')).drop(columns='fold')
+        confusion = pd.read_parquet(os.path.join(path, 'confusion.parquet')).drop(columns='fold')
+        types = [t for t in IMPORTANCE_TYPES if os.path.exists(os.path.join(path, 'importance_%s.parquet' % t))]
+        importance = [pd.read_parquet(os.path.join(path, 'importance_%s.parquet' % t)).drop(columns='fold')
+                      for t in types]
+        n_fold = len(metrics)
+        metric_names = tuple(c.split('_', 1)[1] for c in metrics.columns[:metrics.shape[1] // len(SPLITS)])
+        n_class = int(round((confusion.shape[1] // len(SPLITS)) ** 0.5))
+        return cls(metrics.to_numpy().reshape(n_fold, len(SPLITS), -1),
+                   confusion.to_numpy().reshape(n_fold, len(SPLITS), n_class, n_class),
+                   ImportanceStack(np.stack([imp.to_numpy() for imp in importance]),
+                                   np.asarray(importance[0].columns, dtype=object), tuple(types)),
+                   metric_names)
@@ -0,0 +1,60 @@
+"""Metric curves over boosting rounds from a single trained booster.
+
+Instead of an ``xgb.cv`` pre-pass to choose num_round, each fold is trained
+once to the maximum round count and the prediction of every prefix
+``iteration_range=(0, r)`` is recovered.  Predicting each prefix separately
+would evaluate O(num_round^2) trees; `round_margins` predicts one round at a
+time and accumulates the margins, so it evaluates each tree once.
+
+`cv_curves` returns the same ``test-auc-mean`` / ``test-auc-std`` columns as
+``xgb.cv``, so the scripts' plotting and argmax code works unchanged.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .metrics import auc, ovr_auc
+
+
+def round_margins(bst, dmat, num_round):
+    """(num_round, n_data[, n_class]) raw margins of the first 1..num_round rounds."""
+    full = bst.predict(dmat, output_margin=True, iteration_range=(0, num_round)).astype(np.float64)
+    if num_round == 1:
+        return full[None]
+    steps = np.stack([bst.predict(dmat, output_margin=True, iteration_range=(r, r + 1))
+                      for r in range(num_round)]).astype(np.float64)
+    # every single-round prediction carries the base margin once
+    base = (steps.sum(axis=0) - full) / (num_round - 1)
+    return np.cumsum(steps - base, axis=0) + base
+
+
+def margins_to_prob(margins, n_class):
+    if n_class == 2:
+        return 1.0 / (1.0 + np.exp(-margins))
+    e = np.exp(margins - margins.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def round_curves(y, prob, n_class):
+    """Per-round error / logloss / auc (``merror`` / ``mlogloss`` for multiclass)."""
+    eps = 1e-15
+    if n_class == 2:
+        p = np.clip(prob, eps, 1 - eps)
+        return {'error': ((prob > 0.5) != y).mean(axis=1),
+                'logloss': -(y * np.log(p) + (1 - y) * np.log(1 - p)).mean(axis=1),
+                'auc': auc(y, prob)}
+    p = np.clip(prob[:, np.arange(len(y)), y], eps, 1)
+    return {'merror': (prob.argmax(axis=2) != y).mean(axis=1),
+            'mlogloss': -np.log(p).mean(axis=1),
+            'auc': ovr_auc(y, prob, n_class)}
+
+
+def cv_curves(outputs):
+    """``xgb.cv``-style frame (``<split>-<metric>-mean`` / ``-std``, one row per round)."""
+    cols = {}
+    for split in ['train', 'test']:
+        for name in outputs[0].curves[split]:
+            stack = np.stack([o.curves[split][name] for o in outputs])
+            cols[split + '-' + name + '-mean'] = stack.mean(axis=0)
+            cols[split + '-' + name + '-std'] = stack.std(axis=0)
+    return pd.DataFrame(cols)
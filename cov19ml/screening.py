@@ -0,0 +1,142 @@
+"""In-fold univariate screening: Mann-Whitney U, Benjamini-Hochberg FDR, log2FC.
+
+The Fig2 volcano scripts run ``wilcox.test`` per antigen on the whole
+cohort, then ``p.adjust(method = "BH")`` and ``log2(mean_case / mean_hc)``.
+Used as a pre-filter for a classifier, that screen has to see the training
+rows only.  `screen` computes the same statistics for every antigen in one
+call: each column is sorted once, ties get midranks, and the U statistics,
+tie-corrected normal p-values, FDR and fold changes come out as arrays.
+
+`screened_run` is the CV stage: inside every fold the screen runs on the
+training rows, and the fold's booster trains on the antigens that pass.
+
+    selected, outputs = screened_run(engine, extfig5_param, 40, fdr=0.05, min_log2fc=1)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu, norm
+
+from .metrics import midranks
+
+
+def tie_sizes(sorted_rows):
+    """Size of the tie group of every entry of already sorted rows."""
+    new = np.ones(sorted_rows.shape, dtype=bool)
+    new[..., 1:] = sorted_rows[..., 1:] != sorted_rows[..., :-1]
+    group = np.cumsum(new.ravel()) - 1
+    return np.bincount(group)[group].reshape(sorted_rows.shape)
+
+
+def mann_whitney(X, case, control=None):
+    """Two-sided Wilcoxon rank-sum test of every column, as R's ``wilcox.test(case, control)``.
+
+    X is (n_data, n_features); `case` / `control` are boolean row masks
+    (control defaults to the other rows).  NaNs are dropped per column.
+    Returns (W, p): W is the case rank sum minus n1 (n1 + 1) / 2.  Like R,
+    columns with fewer than 50 values per group and no ties get the exact
+    p-value, the rest the normal approximation with tie and continuity
+    correction.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    case = np.asarray(case, dtype=bool)
+    control = ~case if control is None else np.asarray(control, dtype=bool)
+    rows = case | control
+    V = X[rows].T
+    g = case[rows]
+    order = np.argsort(V, axis=1, kind='stable')
+    s = np.take_along_axis(V, order, axis=1)
+    valid = ~np.isnan(s)
+    in_case = g[order] & valid
+    ranks = midranks(s)
+    t = tie_sizes(s)
+    n1 = in_case.sum(axis=1)
+    n2 = valid.sum(axis=1) - n1
+    n = n1 + n2
+    W = (ranks * in_case).sum(axis=1) - n1 * (n1 + 1) / 2
+    ties = ((t ** 3 - t) / t * valid).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = W - n1 * n2 / 2
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (z - 0.5 * np.sign(z)) / sigma
+        p = np.minimum(1, 2 * norm.sf(np.abs(z)))
+    exact = np.flatnonzero((n1 < 50) & (n2 < 50) & (ties == 0) & (n1 > 0) & (n2 > 0))
+    for j in exact:
+        x = V[j, g]
+        y = V[j, ~g]
+        p[j] = mannwhitneyu(x[~np.isnan(x)], y[~np.isnan(y)], method='exact').pvalue
+    return W, p
+
+
+def bh_fdr(p):
+    """Benjamini-Hochberg adjusted p-values (R's ``p.adjust(p, "BH")``); NaN stays NaN."""
+    p = np.asarray(p, dtype=np.float64)
+    out = np.full(p.shape, np.nan)
+    ok = np.flatnonzero(~np.isnan(p))
+    m = len(ok)
+    if m:
+        order = np.argsort(-p[ok], kind='stable')
+        adj = np.minimum.accumulate(p[ok][order] * m / np.arange(m, 0, -1))
+        out[ok[order]] = np.minimum(adj, 1)
+    return out
+
+
+def log2_fold_change(X, case, control=None):
+    """``log2(mean(case) / mean(control))`` of every column, NaNs ignored."""
+    X = np.asarray(X, dtype=np.float64)
+    case = np.asarray(case, dtype=bool)
+    control = ~case if control is None else np.asarray(control, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.log2(np.nanmean(X[case], axis=0) / np.nanmean(X[control], axis=0))
+
+
+def screen(X, case, control=None):
+    """W, p-value, FDR and log2FC of every column: a dict of (n_features,) arrays."""
+    W, p = mann_whitney(X, case, control)
+    return {'W': W, 'p': p, 'fdr': bh_fdr(p), 'log2fc': log2_fold_change(X, case, control)}
+
+
+def screen_frame(X, case, control=None, feature_names=None):
+    """`screen` as the scripts' results_df (Gene, Log2FC, PValue, FDR)."""
+    s = screen(X, case, control)
+    return pd.DataFrame({'Gene': feature_names if feature_names is not None else np.arange(len(s['p'])),
+                         'W': s['W'], 'Log2FC': s['log2fc'], 'PValue': s['p'], 'FDR': s['fdr']})
+
+
+def passing(stats, fdr=0.05, min_log2fc=None, max_features=None):
+    """Column indices passing the screen, most significant first."""
+    keep = stats['fdr'] < fdr
+    if min_log2fc is not None:
+        keep &= stats['log2fc'] > min_log2fc
+    cols = np.flatnonzero(keep)
+    cols = cols[np.argsort(stats['p'][cols], kind='stable')]
+    return cols if max_features is None else cols[:max_features]
+
+
+def fold_screens(engine, positive=1):
+    """`screen` of the training rows of every fold, case = target == `positive`."""
+    X = np.asarray(engine.X)
+    out = []
+    for tr, _ in engine.folds:
+        case = engine.y[tr] == positive
+        out.append(screen(X[tr], case))
+    return out
+
+
+def screened_run(engine, param, num_round, fdr=0.05, min_log2fc=None, max_features=None,
+                 positive=1, budget=None):
+    """Train every fold on the antigens its training rows pass the screen with.
+
+    Returns (selected, outputs): the per-fold lists of antigen names and the
+    `FoldOutput` of each fold (importances full-width, zero for screened-out
+    antigens).  A fold where nothing passes raises ValueError.
+    """
+    from .selection import train_subsets
+    picks = [passing(s, fdr, min_log2fc, max_features) for s in fold_screens(engine, positive)]
+    for i, cols in enumerate(picks):
+        if not len(cols):
+            raise ValueError('no antigen passes the screen in fold %d' % i)
+    trained = train_subsets(engine, list(enumerate(picks)), param, num_round, budget)
+    outputs = [trained[(i, tuple(int(c) for c in cols))] for i, cols in enumerate(picks)]
+    names = engine.feature_names
+    return [[str(f) for f in names[cols]] for cols in picks], outputs
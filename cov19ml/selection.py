@@ -0,0 +1,208 @@
+"""Strictly cross-validated feature selection (ExtFig5).
+
+The ExtFig5 scripts xgboost_2class_strictly_cv_allfeatures_top1..top5_mcc.py
+differ only in n_selected_features, and each retrains the same all-feature
+stage-1 booster on every fold.  `topk_sweep` trains stage 1 once per fold,
+selects the top-k antigens of each fold's booster for every requested k
+(ties at the k-th importance included, as in the scripts) and trains the
+stage-2 models for all (fold, k) pairs, in the engine's process pool when a
+`CoreBudget` is given.  Identical selections are trained once.
+
+`recursive_elimination` goes further: inside every fold it repeatedly drops
+the least important antigens in chunks down to `min_features`, recording
+the elimination order and the train/test metrics at each panel size.  Steps
+train on column slices of the engine's (binned) matrix.  A step that only
+drops antigens unused by the current booster is not retrained: no tree
+splits on them, so the booster trained without them is the same one.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .cv import METRICS
+from .importance import IMPORTANCE_TYPES
+from .results import SPLITS, FoldResults
+
+
+def extfig5_param(y_tr, n_class=2, eta=0.05, **kwargs):
+    """Parameters of the ExtFig5 strictly-CV scripts."""
+    param = {'objective': 'binary:logistic', 'eta': eta, 'subsample': 0.25,
+             'eval_metric': ['error', 'auc', 'logloss']}
+    param.update(kwargs)
+    return param
+
+
+def select_top_k(importance, k):
+    """Indices of the top-k features, plus any tied with the k-th (scripts' ``>= f_imp`` rule)."""
+    importance = np.asarray(importance)
+    order = np.argsort(-importance, kind='stable')
+    cut = importance[order[k - 1]]
+    return order[importance[order] >= cut]
+
+
+def _stage2(i, cols, param, num_round, nthread):
+    from . import cv
+    return cv._ENGINE.train_fold(i, param, num_round, nthread, cols=cols)
+
+
+def train_subsets(engine, jobs, param, num_round, budget=None):
+    """Train every (fold, column indices) job once; returns {(fold, cols tuple): FoldOutput}."""
+    unique = list(dict.fromkeys((i, tuple(int(c) for c in cols)) for i, cols in jobs))
+    if budget is None or len(unique) <= 1:
+        return {job: engine.train_fold(job[0], param, num_round, cols=list(job[1])) for job in unique}
+    budget = budget.resolve(len(unique))
+    with engine.pool(budget.fold_workers) as ex:
+        futures = {job: ex.submit(_stage2, job[0], list(job[1]), param, num_round, budget.nthread)
+                   for job in unique}
+        return {job: f.result() for job, f in futures.items()}
+
+
+@dataclass
+class TopKSweep:
+    stage1: list
+    selected: dict   # k -> list of per-fold feature name lists
+    results: dict    # k -> FoldResults of the stage-2 models
+
+    def summary(self, k):
+        """ExtFig5 performance table: metrics x (train mean, train stddev, valid mean, valid stddev)."""
+        r = self.results[k]
+        tr, te = r.metrics[:, 0], r.metrics[:, 1]
+        return pd.DataFrame({'train mean': tr.mean(axis=0), 'train stddev': tr.std(axis=0),
+                             'valid mean': te.mean(axis=0), 'valid stddev': te.std(axis=0)},
+                            index=list(r.metric_names))
+
+    def curve(self, stat='valid mean'):
+        """Metric x k table (``df_valid_mean`` of xgboost_2class_plot_mcc.py)."""
+        return pd.DataFrame({'top%d' % k: self.summary(k)[stat] for k in self.results})
+
+
+def topk_sweep(engine, param=extfig5_param, num_round=40, ks=range(1, 6), budget=None):
+    """Stage 1 once per fold, then stage-2 models for every k in `ks`."""
+    stage1 = list(engine.run(param, num_round, budget=budget))
+    names = engine.feature_names
+    picks = {k: [select_top_k(o.importance[0], k) for o in stage1] for k in ks}
+    jobs = [(o.fold, picks[k][n]) for k in ks for n, o in enumerate(stage1)]
+    trained = train_subsets(engine, jobs, param, num_round, budget)
+    results, selected = {}, {}
+    for k in ks:
+        outputs = [trained[(o.fold, tuple(int(c) for c in picks[k][n]))] for n, o in enumerate(stage1)]
+        results[k] = FoldResults.from_outputs(outputs, names, engine.n_class)
+        selected[k] = [[str(f) for f in names[c]] for c in picks[k]]
+    return TopKSweep(stage1, selected, results)
+
+
+def elimination_sizes(n_features, step=1, min_features=1):
+    """Panel sizes visited by RFE: drop `step` features per step (an int), or
+    that fraction of the remaining ones (a float < 1), down to `min_features`."""
+    sizes = [n_features]
+    while sizes[-1] > min_features:
+        n = sizes[-1]
+        drop = int(step) if step >= 1 else max(1, int(step * n))
+        sizes.append(max(min_features, n - drop))
+    return sizes
+
+
+def _fold_rows(out):
+    return [[out.metrics[split + '_' + m] for m in METRICS] for split in SPLITS]
+
+
+def _rfe_fold(engine, i, param, num_round, sizes, importance_type='weight', nthread=None):
+    """Elimination order, per-size metrics and number of boosters trained for fold `i`."""
+    p = engine.param_for(param, engine.y[engine.folds[i][0]])
+    # with column sampling the booster depends on which columns exist
+    reuse = not any(k.startswith('colsample') and v != 1 for k, v in p.items())
+    t = IMPORTANCE_TYPES.index(importance_type)
+    cols = np.arange(len(engine.feature_names))
+    order = []
+    metrics = np.empty((len(sizes), len(SPLITS), len(METRICS)))
+    out, n_trained, stale = None, 0, True
+    for s, n in enumerate(sizes):
+        if stale:
+            out = engine.train_fold(i, param, num_round, nthread, cols=cols)
+            n_trained += 1
+        metrics[s] = _fold_rows(out)
+        imp = out.importance[t, cols]
+        if s + 1 == len(sizes):
+            order.extend(cols[np.argsort(imp, kind='stable')])
+            break
+        drop = np.argsort(imp, kind='stable')[:n - sizes[s + 1]]
+        stale = not reuse or bool(np.any(out.importance[0, cols[drop]] > 0))
+        order.extend(cols[drop])
+        cols = np.delete(cols, drop)
+    return np.asarray(order), metrics, n_trained
+
+
+def _rfe_job(i, param, num_round, sizes, importance_type, nthread):
+    from . import cv
+    return _rfe_fold(cv._ENGINE, i, param, num_round, sizes, importance_type, nthread)
+
+
+@dataclass
+class RFEResult:
+    """RFE inside every fold.
+
+    ``order`` is (n_fold, n_feature): feature indices in elimination order, so
+    the panel of size n in fold f is ``order[f, -n:]``.  ``metrics`` is
+    (n_fold, n_size, 2, n_metric) for the panel sizes in ``sizes``.
+    """
+    sizes: list
+    order: np.ndarray
+    metrics: np.ndarray
+    feature_names: np.ndarray
+    n_trained: np.ndarray
+    metric_names: tuple = tuple(METRICS)
+
+    def selected(self, fold, n):
+        """Names of the `n` antigens kept in `fold`, most important last."""
+        return [str(f) for f in self.feature_names[self.order[fold, -n:]]]
+
+    def path(self, fold):
+        """Per-size table for one fold: test metrics and the antigens removed after that step."""
+        te = self.metrics[fold, :, SPLITS.index('test')]
+        table = pd.DataFrame(te, index=pd.Index(self.sizes, name='n_features'),
+                             columns=list(self.metric_names))
+        removed, start = [], 0
+        for s, n in enumerate(self.sizes):
+            end = len(self.feature_names) - (self.sizes[s + 1] if s + 1 < len(self.sizes) else 0)
+            removed.append([str(f) for f in self.feature_names[self.order[fold, start:end]]])
+            start = end
+        table['removed'] = removed
+        return table
+
+    def curve(self, metric='mcc', split='test'):
+        """Panel size x fold table of one metric, with mean and std (ddof=0) columns."""
+        v = self.metrics[:, :, SPLITS.index(split), self.metric_names.index(metric)].T
+        table = pd.DataFrame(v, index=pd.Index(self.sizes, name='n_features'),
+                             columns=['cv%d' % f for f in range(v.shape[1])])
+        table['mean'] = v.mean(axis=1)
+        table['std'] = v.std(axis=1)
+        return table
+
+    def frequency(self, n):
+        """How many folds keep each antigen in their size-`n` panel, sorted."""
+        counts = np.bincount(self.order[:, -n:].ravel(), minlength=len(self.feature_names))
+        return pd.Series(counts, index=self.feature_names, name='n_folds').sort_values(ascending=False)
+
+
+def recursive_elimination(engine, param=extfig5_param, num_round=40, step=1, min_features=1,
+                          importance_type='weight', budget=None):
+    """Strictly cross-validated RFE: each fold ranks and prunes on its own training rows.
+
+    `step` features (or a fraction of those left, if a float < 1) are dropped
+    per step by `importance_type`.  With a `CoreBudget` the folds run in the
+    engine's process pool; `param` must then be picklable.
+    """
+    sizes = elimination_sizes(len(engine.feature_names), step, min_features)
+    if budget is None:
+        rows = [_rfe_fold(engine, i, param, num_round, sizes, importance_type)
+                for i in range(engine.n_fold)]
+    else:
+        budget = budget.resolve(engine.n_fold)
+        with engine.pool(budget.fold_workers) as ex:
+            jobs = [ex.submit(_rfe_job, i, param, num_round, sizes, importance_type, budget.nthread)
+                    for i in range(engine.n_fold)]
+            rows = [job.result() for job in jobs]
+    order, metrics, n_trained = zip(*rows)
+    return RFEResult(sizes, np.stack(order), np.stack(metrics), engine.feature_names, np.asarray(n_trained))
@@ -0,0 +1,93 @@
+"""Columnar store of out-of-fold predictions.
+
+Every test-fold probability of a CV run is written with its experiment key,
+seed, fold id and sample ID, one Parquet file per (experiment, seed) under
+``<root>/<experiment>/seed=<seed>.parquet``.  Any metric, subgroup breakdown
+or plot can then be recomputed from the stored predictions instead of
+retraining the boosters.
+
+    store = OOFStore('/content/drive/MyDrive/COV19ML_share/oof')
+    store.write_run('xgb_2class_all', engine, outputs)
+    oof = store.read('xgb_2class_all')
+    store.fold_metrics(oof)
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from .metrics import score_auc, threshold_metrics
+
+
+def prob_columns(n_class):
+    return ['prob'] if n_class == 2 else ['prob_%d' % c for c in range(n_class)]
+
+
+class OOFStore:
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, experiment, seed):
+        return os.path.join(self.root, experiment, 'seed=%d.parquet' % seed)
+
+    def frame(self, experiment, seed, outputs, y, ids, n_class):
+        """Long table (one row per sample) of the test-fold predictions of `outputs`."""
+        te = np.concatenate([o.te for o in outputs])
+        prob = np.concatenate([o.pred_te for o in outputs]).astype(np.float32)
+        df = pd.DataFrame({
+            'experiment': pd.Categorical([experiment] * len(te)),
+            'seed': np.full(len(te), seed, dtype=np.int32),
+            'fold': np.concatenate([np.full(len(o.te), o.fold, dtype=np.int16) for o in outputs]),
+            'sample_id': np.asarray(ids)[te].astype(str),
+            'row': te.astype(np.int32),
+            'y': np.asarray(y)[te].astype(np.int8),
+        })
+        cols = prob_columns(n_class)
+        prob = prob.reshape(len(te), len(cols))
+        for j, c in enumerate(cols):
+            df[c] = prob[:, j]
+        return df
+
+    def write(self, df):
+        experiment = str(df['experiment'].iloc[0])
+        seed = int(df['seed'].iloc[0])
+        path = self.path(experiment, seed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp%d' % os.getpid()
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        return path
+
+    def write_run(self, experiment, engine, outputs):
+        """Store the out-of-fold predictions of one `CVEngine` run (seed = engine.seed)."""
+        return self.write(self.frame(experiment, engine.seed, outputs, engine.y,
+                                     engine.ids, engine.n_class))
+
+    def experiments(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def read(self, experiment, seeds=None, columns=None):
+        """Stored predictions of `experiment` (optionally only some seeds / columns)."""
+        paths = sorted(glob.glob(os.path.join(self.root, experiment, 'seed=*.parquet')))
+        if seeds is not None:
+            paths = [self.path(experiment, s) for s in seeds]
+        return pd.concat([pd.read_parquet(p, columns=columns) for p in paths], ignore_index=True)
+
+    @staticmethod
+    def fold_metrics(df, threshold=0.5):
+        """Test metrics per (seed, fold) recomputed from stored predictions."""
+        cols = [c for c in df.columns if c.startswith('prob')]
+        n_class = 2 if cols == ['prob'] else len(cols)
+        rows = []
+        for (seed, fold), g in df.groupby(['seed', 'fold'], sort=True):
+            y = g['y'].to_numpy()
+            prob = g[cols].to_numpy()
+            prob = prob[:, 0] if n_class == 2 else prob
+            _, m = threshold_metrics(y, prob, n_class, threshold)
+            row = {'seed': seed, 'fold': fold, 'auc': float(score_auc(y, prob, n_class))}
+            row.update({k: float(v) for k, v in m.items()})
+            rows.append(row)
+        return pd.DataFrame(rows)
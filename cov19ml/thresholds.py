@@ -0,0 +1,61 @@
+"""Binary metrics at every decision threshold from a single sort.
+
+The scripts cut probabilities at exactly 0.5, although scale_pos_weight
+shifts the probability scale.  `threshold_sweep` sorts the scores once and
+reads the confusion counts at every distinct threshold off cumulative sums
+(O(n log n) overall), then derives all metrics with `metrics.confusion_metrics`.
+
+A prediction is positive when ``score >= threshold``, as in
+`metrics.predict_labels`.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .metrics import confusion_metrics, threshold_metrics
+
+
+def threshold_sweep(y_true, score):
+    """Confusion matrices and metrics at every distinct threshold.
+
+    Returns a dict with ``threshold`` (descending, starting at +inf where
+    nothing is positive), ``confusion`` of shape (n_thresholds, 2, 2) and one
+    array per metric of `metrics.THRESHOLD_METRICS`.
+    """
+    score = np.asarray(score, dtype=float)
+    y = np.asarray(y_true) == 1
+    order = np.argsort(-score, kind='stable')
+    s, y = score[order], y[order]
+    # last position of each tie group: everything up to it is predicted positive
+    last = np.r_[np.flatnonzero(s[1:] != s[:-1]), len(s) - 1]
+    tp = np.r_[0, np.cumsum(y)[last]]
+    fp = np.r_[0, np.cumsum(~y)[last]]
+    n_pos = y.sum()
+    n_neg = len(y) - n_pos
+    cm = np.stack([np.stack([n_neg - fp, fp], axis=-1),
+                   np.stack([n_pos - tp, tp], axis=-1)], axis=-2)
+    out = {'threshold': np.r_[np.inf, s[last]], 'confusion': cm}
+    out.update(confusion_metrics(cm))
+    return out
+
+
+def best_threshold(y_true, score, metric='mcc'):
+    """Threshold maximizing `metric` (the highest one among ties)."""
+    sweep = threshold_sweep(y_true, score)
+    return sweep['threshold'][int(np.argmax(sweep[metric]))]
+
+
+def tuned_threshold_metrics(y_tr, score_tr, y_te, score_te, metric='mcc'):
+    """Pick the `metric`-optimal threshold on the training fold and apply it to the test fold."""
+    t = best_threshold(y_tr, score_tr, metric)
+    cm, m = threshold_metrics(y_te, score_te, 2, t)
+    return t, cm, {k: float(v) for k, v in m.items()}
+
+
+def tuned_table(outputs, y, metric='mcc'):
+    """Per-fold table of the training-fold-tuned threshold and the test metrics it gives."""
+    rows = []
+    for o in outputs:
+        t, _, m = tuned_threshold_metrics(y[o.tr], o.pred_tr, y[o.te], o.pred_te, metric)
+        rows.append(dict(threshold=t, **{'test_' + k: v for k, v in m.items()}))
+    return pd.DataFrame(rows)